@@ -0,0 +1,147 @@
+"""Admission control: rate limits, concurrency limits and load shedding in front of the database
+
+When the database slows down, requests hold their threads while they wait for pool connections, new requests
+queue up behind them and every client sees the latency. Admission decides before a request runs:
+
+- every client has a token bucket, requests beyond its rate get 429 with Retry-After;
+- reads (GET, HEAD) and writes have separate limits of requests running at a time, a bounded number of requests
+  waits a short time for a slot, beyond that they get 503;
+- while checkouts from the connection pool wait longer than `max_pool_wait`, requests get 503 right away.
+
+Rejections are answered in the JSON format of error_handlers.py, {"message": ...}.
+"""
+import math
+import time
+from collections import OrderedDict
+from threading import Condition, Lock
+from flask import current_app, g, jsonify, make_response, request
+
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+# never limited, so that monitoring keeps working under overload
+EXEMPT_ENDPOINTS = frozenset(('metrics',))
+
+
+class RateLimiter(object):
+    """Token buckets of `rate` requests per second and `burst` requests, one per client key
+
+    The buckets of the `max_clients` most recently seen clients are kept, an evicted client starts with a full one.
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def acquire(self, key):
+        """Take a token of `key`, return 0 or the seconds until the next token when the bucket is empty"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < 1:
+                return (1 - bucket[0]) / self.rate
+            bucket[0] -= 1
+            return 0
+
+
+class ConcurrencyLimit(object):
+    """At most `limit` requests at a time; up to `max_queue` more wait at most `timeout` seconds for a slot"""
+
+    def __init__(self, limit, max_queue=0, timeout=0):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._condition = Condition()
+
+    def acquire(self):
+        """Take a slot, return False when the queue is full or the wait timed out"""
+        with self._condition:
+            if self.active >= self.limit:
+                if self.waiting >= self.max_queue:
+                    return False
+                self.waiting += 1
+                try:
+                    if not self._condition.wait_for(lambda: self.active < self.limit, self.timeout):
+                        return False
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+def overloaded(status, message, retry_after):
+    response = make_response(jsonify({'message': message}), status)
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class Admission(object):
+    """Admission control of a Flask app, every limit is switched off with None
+
+    `rate` and `burst` limit the requests of a client, `max_reads` and `max_writes` the requests running at a time,
+    `max_queue` and `queue_timeout` the requests waiting for them, and `max_pool_wait` (seconds) sheds load while the
+    database pool is saturated. `retry_after` is the Retry-After of 503 responses.
+    """
+
+    def __init__(self, rate=None, burst=None, max_reads=None, max_writes=None, max_queue=0, queue_timeout=0,
+                 max_pool_wait=None, retry_after=1):
+        self.rate_limiter = RateLimiter(rate, burst or max(1, math.ceil(rate))) if rate else None
+        self.limits = {
+            'read': ConcurrencyLimit(max_reads, max_queue, queue_timeout) if max_reads else None,
+            'write': ConcurrencyLimit(max_writes, max_queue, queue_timeout) if max_writes else None,
+        }
+        self.max_pool_wait = max_pool_wait
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(rate=config['ADMISSION_RATE'], burst=config['ADMISSION_BURST'],
+                   max_reads=config['ADMISSION_MAX_READS'], max_writes=config['ADMISSION_MAX_WRITES'],
+                   max_queue=config['ADMISSION_MAX_QUEUE'], queue_timeout=config['ADMISSION_QUEUE_TIMEOUT'],
+                   max_pool_wait=config['ADMISSION_MAX_POOL_WAIT'], retry_after=config['ADMISSION_RETRY_AFTER'])
+
+    def init_app(self, app, client_key):
+        """Check every request before it runs, `client_key()` names the client its rate limit is counted on"""
+        self.client_key = client_key
+        app.extensions['admission'] = self
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+
+    def _admit(self):
+        if request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.acquire(self.client_key())
+            if wait:
+                return overloaded(429, 'Too many requests', wait)
+        if self.max_pool_wait is not None:
+            waiting, pool_wait = current_app.extensions['task_metrics'].pool_pressure()
+            if waiting and pool_wait > self.max_pool_wait:
+                return overloaded(503, 'The database is overloaded, try again later', self.retry_after)
+        limit = self.limits['read' if request.method in READ_METHODS else 'write']
+        if limit is not None:
+            if not limit.acquire():
+                return overloaded(503, 'Too many concurrent requests, try again later', self.retry_after)
+            g.admission_limit = limit
+        return None
+
+    def _release(self, exception=None):
+        limit = g.pop('admission_limit', None)
+        if limit is not None:
+            limit.release()
@@ -1,131 +1,842 @@
-from flask import Flask, jsonify, make_response
-from flask_restful import Api, Resource, reqparse, marshal_with
-from flask_httpauth import HTTPBasicAuth
-from sqlalchemy.exc import DataError
-from models import db, Tasks, task_fields
-from config import LOGIN, PASSWORD, HOST, PORT
+import json
+import zlib
+from functools import partial
+from flask import Flask, Request, Response, jsonify, make_response, current_app, request, stream_with_context
+from flask_restful import Api, Resource, marshal_with, abort
+from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth, MultiAuth
+from sqlalchemy import select, insert, update, delete, and_, or_, union_all
+from sqlalchemy.exc import SQLAlchemyError, DataError
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.http import quote_etag
+from models import db, Tasks, ArchivedTasks, TaskTombstones, task_fields, task_columns, archived_task_columns, \
+    serialize_task
+from config import HOST, PORT
 from datetime import datetime
 from error_handlers import register_error_handlers
+from logs import QueueLogging
+from routing import replica_bind_keys
+from sharding import TaskShards, shard_bind_keys, owner_shard, task_engines
+from id_allocator import IdAllocator
+from group_commit import GroupCommitWriter
+from search import FullTextSearch, InvertedIndex
+from metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from credentials import Authenticator
+from admission import Admission
+from stats import TaskStats, start_reconciler
+from importer import FORMATS as IMPORT_FORMATS, buffered, csv_records, ndjson_records, import_records
+from changes import take_change_seqs, tombstones, read_changes, cursor_expired, start_pruner
+from archive import start_archiver
+from jobs import ProcessJobs
+from versioning import task_etag, tasks_version, bump_tasks_version
+from validation import Schema, Field, ValidationError, string, boolean, natural, positive, utc_datetime, cursor
 import configmodule
 
-auth = HTTPBasicAuth()
+basic_auth = HTTPBasicAuth()
+token_auth = HTTPTokenAuth(scheme='Bearer')
+auth = MultiAuth(basic_auth, token_auth)
 
 
-@auth.get_password
-def get_password(username):
-    if username == LOGIN:
-        return PASSWORD
-    return None
+def authenticator():
+    return current_app.extensions['authenticator']
 
 
-@auth.error_handler
+@basic_auth.verify_password
+def verify_password(username, password):
+    return authenticator().verify_password(username, password)
+
+
+@token_auth.verify_token
+def verify_token(token):
+    return authenticator().verify_token(token)
+
+
+def current_owner():
+    """Owner of the tasks a request reads and writes, its authenticated user"""
+    return auth.current_user()
+
+
+def client_key():
+    """Key of the rate limit of a request: its user, or its client address until the credentials are verified
+
+    Passwords are only looked up in the cache of verified credentials, hashing them here would double the cost.
+    """
+    authorization = request.authorization
+    user = None
+    if authorization is not None and authorization.type == 'basic':
+        user = authenticator().verified(authorization.username, authorization.password)
+    elif authorization is not None and authorization.type == 'bearer':
+        user = authenticator().verify_token(authorization.token)
+    return f'user:{user}' if user else f'address:{request.remote_addr}'
+
+
+@basic_auth.error_handler
+@token_auth.error_handler
 def unauthorized():
     # return 403 instead of 401 to prevent browsers from displaying the default
     return make_response(jsonify({'message': 'Unauthorized access'}), 403)
 
 
+def task_filters(args, table=Tasks.__table__):
+    """Build the filter clauses for the task list from parsed query arguments and the owner in args['owner']"""
+    clauses = []
+    if args.get('owner') is not None:
+        clauses.append(table.c.owner == args['owner'])
+    if args.get('completed') is not None:
+        clauses.append(table.c.completed == args['completed'])
+    if args.get('created_after') is not None:
+        clauses.append(table.c.created_at >= args['created_after'])
+    if args.get('created_before') is not None:
+        clauses.append(table.c.created_at < args['created_before'])
+    return clauses
+
+
+# sort orders of the task list, each backed by an index on (owner, column, id) and (owner, completed, column, id)
+SORT_COLUMNS = ('id', 'created_at', 'updated_at')
+
+
+def keyset_clause(column, value, task_id, descending):
+    """Clause selecting the rows that follow the row (value, task_id) in (column, id) order
+
+    NULLs sort before any value, as they do in MySQL and SQLite.
+    """
+    id_column = column.table.c.id
+    if column is id_column:
+        return id_column < task_id if descending else id_column > task_id
+    if descending:
+        if value is None:
+            return and_(column.is_(None), id_column < task_id)
+        return or_(column < value, and_(column == value, id_column < task_id), column.is_(None))
+    if value is None:
+        return or_(and_(column.is_(None), id_column > task_id), column.isnot(None))
+    return or_(column > value, and_(column == value, id_column > task_id))
+
+
+def task_tables(args):
+    """Tables a list reads: the tasks, and the archived tasks with include_archived"""
+    return (Tasks.__table__, ArchivedTasks.__table__) if args.get('include_archived') else (Tasks.__table__,)
+
+
+def order_by_sort(statement, column, descending):
+    columns = [column] if column is column.table.c.id else [column, column.table.c.id]
+    return statement.order_by(*[column.desc() if descending else column for column in columns])
+
+
+def page_cursor(args):
+    """(sort value, id) pair of the row the page follows, from args['after'], or None for the first page
+
+    The sort value travels in the cursor, so that a change to that row does not move the next page. A bare id
+    is a cursor of the id order only; ValidationError for one given with another sort.
+    """
+    after = args['after']
+    if after is None:
+        return None
+    if args['sort'] == 'id':
+        return None, after[1] if isinstance(after, tuple) else after
+    if not isinstance(after, tuple):
+        raise ValidationError('after', f"Invalid value for after: {after} (must be the next of a page sorted by "
+                                       f"{args['sort']})")
+    return after
+
+
+def next_cursor(args, row):
+    """`next` of a page ending with `row`: its id, or '<sort value>,<id>' when sorted by another column"""
+    if args['sort'] == 'id':
+        return row.id
+    value = row._mapping[args['sort']]
+    return f"{'' if value is None else value.isoformat()},{row.id}"
+
+
+def task_page_statement(args, limit, after=None):
+    """SELECT of task_columns rows of the list in the order of args['sort'] and args['order'], up to `limit`
+
+    Rows follow the (sort value, id) pair `after`, see page_cursor. With include_archived every table is read up
+    to `limit` rows through its own (column, id) index and the results are merged.
+    """
+    descending = args['order'] == 'desc'
+    statements = []
+    for table in task_tables(args):
+        statement = select(*[table.c[column.key] for column in task_columns]).where(*task_filters(args, table))
+        if after is not None:
+            statement = statement.where(keyset_clause(table.c[args['sort']], *after, descending))
+        statements.append(order_by_sort(statement, table.c[args['sort']], descending).limit(limit))
+    if len(statements) == 1:
+        return statements[0]
+    rows = union_all(*[statement.subquery().select() for statement in statements]).subquery()
+    return order_by_sort(select(*rows.c), rows.c[args['sort']], descending).limit(limit)
+
+
+# writable fields of a task, typed after the columns of Tasks behind task_fields
+task_schema = Schema({name: Field.for_column(Tasks.__table__.c[name])
+                      for name in task_fields if name not in ('id', 'created_at', 'updated_at')})
+task_create_schema = Schema({
+    'title': task_schema.fields['title'].replace(required=True, help='No task title provided'),
+    'description': task_schema.fields['description'].replace(default=''),
+})
+# PUT replaces the task, omitted fields are reset
+task_update_schema = task_schema
+# PATCH changes the fields present in the request only, a null title or completed is refused rather than stored
+task_patch_schema = Schema(dict(task_schema.fields, **{name: task_schema.fields[name].replace(nullable=False)
+                                                       for name in ('title', 'completed')}), partial=True)
+# records of POST /todo/import, checked up to the column sizes so that a bad record is rejected on its own
+task_import_schema = task_create_schema.extend({
+    'title': task_create_schema.fields['title'].replace(max_length=Tasks.__table__.c.title.type.length),
+    'completed': task_schema.fields['completed'].replace(default=False),
+    'created_at': Field.for_column(Tasks.__table__.c.created_at),
+})
+
+# query arguments shared by the task list and the task export
+task_filter_schema = Schema({
+    'after': Field(cursor),
+    'completed': Field(boolean),
+    'created_after': Field(utc_datetime),
+    'created_before': Field(utc_datetime),
+    'include_archived': Field(boolean, default=False),
+})
+task_list_schema = task_filter_schema.extend({
+    'limit': Field(positive),
+    'sort': Field(string, default='id', choices=SORT_COLUMNS),
+    'order': Field(string, default='asc', choices=('asc', 'desc')),
+})
+task_search_schema = Schema({
+    'q': Field(string, required=True, help='No search query provided'),
+    'limit': Field(positive),
+    'offset': Field(natural, default=0),
+})
+task_changes_schema = Schema({'since': Field(natural, default=0), 'limit': Field(positive)})
+
+
+def parse_request(schema, values):
+    """Validate request.args or a JSON body against a schema, aborting with 400 on invalid arguments"""
+    try:
+        return schema.parse(values)
+    except ValidationError as e:
+        abort(400, message={e.name: e.message} if e.name else e.message)
+
+
+def request_json():
+    """The JSON body of the request, {} when it has none
+
+    Bodies over MAX_CONTENT_LENGTH are refused with 413 before they are read.
+    """
+    if not request.get_data(cache=True):
+        return {}
+    return request.get_json()
+
+
+def export_tasks(args):
+    """Stream tasks as NDJSON, one task per line, reading the table in chunks through a server-side cursor"""
+    args = dict(args, sort='id', order='asc')
+    statement = task_page_statement(args, None, page_cursor(args))
+
+    # execute before streaming starts, so that database errors still reach the error handlers
+    result = db.session.execute(statement.execution_options(
+        yield_per=current_app.config['TASKS_EXPORT_CHUNK_SIZE']))
+
+    def generate():
+        try:
+            for rows in result.partitions():
+                yield ''.join(json.dumps(serialize_task(row)) + '\n' for row in rows)
+        finally:
+            result.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def not_modified(etag):
+    return Response(status=304, headers={'ETag': quote_etag(etag)})
+
+
+def task_write_clause(task_id, if_match, owner):
+    """WHERE clause of an UPDATE or DELETE of one task of `owner`, limited to the versions named by If-Match"""
+    clause = and_(Tasks.id == task_id, Tasks.owner == owner)
+    if if_match and not if_match.star_tag:
+        prefix = f'{task_id}.'
+        versions = [int(etag[len(prefix):]) for etag in if_match.as_set()
+                    if etag.startswith(prefix) and etag[len(prefix):].isdigit()]
+        clause = and_(clause, Tasks.version.in_(versions))
+    return clause
+
+
+def execute_task_write(statement, task_id):
+    """Run an UPDATE or DELETE of one task as a single statement
+
+    Returns the (version, *task_columns) row as it is after an UPDATE or was before a DELETE,
+    or None when the WHERE clause matched nothing. The row comes back through RETURNING where
+    the backend supports it; otherwise (MySQL) it is read in the same transaction.
+    """
+    returned = (Tasks.version, *task_columns)
+    dialect = db.session.get_bind().dialect
+    if statement.is_update:
+        if dialect.update_returning:
+            return db.session.execute(statement.returning(*returned)).first()
+        if db.session.execute(statement).rowcount == 0:
+            return None
+        return db.session.execute(select(*returned).where(Tasks.id == task_id)).first()
+
+    if dialect.delete_returning:
+        return db.session.execute(statement.returning(*returned)).first()
+    row = db.session.execute(select(*returned).where(statement.whereclause).with_for_update()).first()
+    if row is not None:
+        db.session.execute(statement)
+    return row
+
+
+def abort_unmatched_write(task_id, owner):
+    """A write of one task matched no row: 404 when the task is gone, 409 when it is archived, else If-Match failed"""
+    if db.session.scalar(select(Tasks.id).where(Tasks.id == task_id, Tasks.owner == owner)) is None:
+        if db.session.scalar(select(ArchivedTasks.id).where(ArchivedTasks.id == task_id,
+                                                            ArchivedTasks.owner == owner)) is not None:
+            abort(409, message=f'Task with id {task_id} is archived')
+        abort(404, message=f'Task with id {task_id} not found')
+    abort(412, message=f'Task with id {task_id} has been modified')
+
+
+def task_cache():
+    return current_app.extensions['task_cache']
+
+
+def task_search():
+    return current_app.extensions['task_search']
+
+
+def tasks_committed(saved=(), deleted=()):
+    """Bring caches and indexes up to date after a committed write
+
+    `saved` are dicts with at least id, owner, title and description of created or updated tasks,
+    `deleted` are ids of deleted tasks.
+    """
+    for task in saved:
+        task_cache().delete(task['id'])
+        task_search().add(task['id'], task['title'], task['description'], task['owner'])
+    for task_id in deleted:
+        task_cache().delete(task_id)
+        task_search().remove(task_id)
+
+
+def task_stats():
+    return current_app.extensions['task_stats']
+
+
+def count_task_changes(owner, total=0, completed=0, created=None):
+    """Add a write of `owner` to its statistics counters, inside its transaction"""
+    statement = task_stats().increment(db.session.get_bind().dialect.name, owner, total, completed, created)
+    if statement is not None:
+        db.session.execute(statement)
+
+
+def change_seqs(owner, count=1):
+    """Numbers of the change feed of `owner` for the rows of a write, take them before its first statement"""
+    return take_change_seqs(db.session.connection(), owner, count)
+
+
+def insert_tasks(rows):
+    """Insert new tasks (dicts of column values) in one transaction, commit and run the post-commit hooks
+
+    The writer of the group-commit mode of POST /todo calls it with the rows of concurrent requests,
+    all of them in the shard of the first one.
+    """
+    owned = {}
+    for row in sorted(rows, key=lambda row: row['owner']):
+        owned.setdefault(row['owner'], []).append(row)
+    with owner_shard(rows[0]['owner']):
+        try:
+            for owner, owner_rows in owned.items():
+                for row, change_seq in zip(owner_rows, change_seqs(owner, len(owner_rows))):
+                    row['change_seq'] = change_seq
+            db.session.connection().execute(insert(Tasks.__table__), rows)
+            for owner, owner_rows in owned.items():
+                created = {}
+                for row in owner_rows:
+                    created[row['created_at'].date()] = created.get(row['created_at'].date(), 0) + 1
+                count_task_changes(owner, total=len(owner_rows),
+                                   completed=sum(int(bool(row['completed'])) for row in owner_rows), created=created)
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        tasks_committed(saved=rows)
+
+
+def tasks_archived(task_ids, engine=None):
+    """Post-commit hook of the archiver of `engine`: the tasks left the list and the search, the cache stays valid"""
+    for task_id in task_ids:
+        task_search().remove(task_id)
+    bump_tasks_version(engine)
+
+
+def shards_rebalanced(source, target):
+    """Hook of sharding.rebalance: recount the statistics of both shards, their lists have changed"""
+    for key in (source, target):
+        task_stats().reconcile(db.engines[key])
+        bump_tasks_version(db.engines[key])
+
+
+def allocate_task_ids(count=1):
+    return current_app.extensions['task_id_allocator'].allocate(count)
+
+
+def import_tasks(records):
+    """Insert and commit one chunk of validated records of POST /todo/import"""
+    now = datetime.utcnow().replace(microsecond=0)
+    owner = current_owner()
+    insert_tasks([{'id': task_id, 'owner': owner, 'title': record['title'], 'description': record['description'],
+                   'completed': record['completed'], 'created_at': record['created_at'] or now,
+                   'updated_at': None, 'version': 1}
+                  for task_id, record in zip(allocate_task_ids(len(records)), records)])
+
+
 class TaskListAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparse = reqparse.RequestParser()
-        self.reqparse.add_argument('title', type=str, required=True,
-                                   help='No task title provided',
-                                   location='json')
-        self.reqparse.add_argument('description', type=str, default="",
-                                   location='json')
-        super(TaskListAPI, self).__init__()
-
-    @marshal_with(task_fields)
     def get(self):
-        tasks = Tasks.query.order_by(Tasks.id).all()
-        return tasks
+        args = dict(parse_request(task_list_schema, request.args), owner=current_owner())
+        if request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) \
+                == 'application/x-ndjson':
+            return export_tasks(args)
+        try:
+            after = page_cursor(args)
+        except ValidationError as e:
+            abort(400, message={e.name: e.message})
+
+        # the version is read before the rows, see tasks_version
+        version = tasks_version(args['owner'])
+        etag = f"tasks.{version}.{zlib.crc32(args['owner'].encode() + b'?' + request.query_string)}"
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        limit = min(args['limit'] or current_app.config['TASKS_PAGE_SIZE'],
+                    current_app.config['TASKS_MAX_PAGE_SIZE'])
+
+        # fetch one extra row to find out whether there is a next page
+        rows = db.session.execute(task_page_statement(args, limit + 1, after)).all()
+        tasks = [serialize_task(row) for row in rows[:limit]]
+        next_page = next_cursor(args, rows[limit - 1]) if len(rows) > limit else None
+
+        return {'tasks': tasks, 'next': next_page}, 200, {'ETag': quote_etag(etag)}
 
     @marshal_with(task_fields)
     def post(self):
-        args = self.reqparse.parse_args()
+        args = parse_request(task_create_schema, request_json())
 
-        max_id = db.session.query(db.func.max(Tasks.id)).scalar() or 0
-        title = args.get('title', '')
-        description = args.get('description', '')
-        completed = args.get('completed', False)
+        task_id, = allocate_task_ids()
+        owner = current_owner()
+        title = args['title']
+        description = args['description']
+        completed = False
         created_at = datetime.utcnow().replace(microsecond=0)
 
-        task_add = Tasks(id=max_id + 1, title=title, description=description,
-                         completed=completed, created_at=created_at)
+        if current_app.config['TASKS_GROUP_COMMIT']:
+            row = {'id': task_id, 'owner': owner, 'title': title, 'description': description,
+                   'completed': bool(completed), 'created_at': created_at, 'updated_at': None, 'version': 1}
+            future = current_app.extensions['task_writer'].submit(row)
+            try:
+                future.result(current_app.config['TASKS_GROUP_COMMIT_TIMEOUT'])
+            except TimeoutError:
+                # not written if the writer has not taken it yet, otherwise it may still be committed
+                future.cancel()
+                abort(503, message='The task was not saved in time, try again later')
+            except DataError as e:
+                raise DataError(params=e.params, orig=e.orig, statement=e.statement)
+            return row, 200, {'ETag': quote_etag(task_etag(task_id, 1))}
+
         try:
+            change_seq, = change_seqs(owner)
+            task_add = Tasks(id=task_id, owner=owner, title=title, description=description,
+                             completed=completed, created_at=created_at, change_seq=change_seq)
             db.session.add(task_add)
+            count_task_changes(owner, total=1, completed=int(bool(completed)), created={created_at.date(): 1})
             db.session.commit()
         except DataError as e:
             db.session.rollback()
             raise DataError(params=e.params, orig=e.orig, statement=e.statement)
-        except BaseException as e:
+        except BaseException:
             db.session.rollback()
-            return make_response(jsonify({'message': str(e)}), 500)
+            raise
 
-        return task_add
+        tasks_committed(saved=[{'id': task_id, 'owner': owner, 'title': title, 'description': description}])
+        return task_add, 200, {'ETag': quote_etag(task_etag(task_add.id, task_add.version))}
 
 
-class TaskAPI(Resource):
+class TaskExportAPI(Resource):
     decorators = [auth.login_required]
 
-    def __init__(self):
-        self.reqparse = reqparse.RequestParser()
-        self.reqparse.add_argument('title', type=str, location='json')
-        self.reqparse.add_argument('description', type=str, location='json')
-        self.reqparse.add_argument('completed', type=bool, location='json')
-        self.reqparse.add_argument('created_at', type=str, location='json')
-        self.reqparse.add_argument('updated_at', type=str, location='json')
-        super(TaskAPI, self).__init__()
+    def get(self):
+        return export_tasks(dict(parse_request(task_filter_schema, request.args), owner=current_owner()))
+
+
+class TaskImportAPI(Resource):
+    """Import tasks from a CSV body (with a header row) or an NDJSON body, read as a stream
+
+    Every TASKS_IMPORT_CHUNK_SIZE valid records are inserted and committed together, so an interrupted
+    import keeps the chunks before the failure. The response counts accepted and rejected records.
+    """
+    decorators = [auth.login_required]
+
+    def post(self):
+        body_format = IMPORT_FORMATS.get(request.mimetype)
+        if body_format is None:
+            return make_response(jsonify({'message': f"Content-Type must be one of {', '.join(IMPORT_FORMATS)}"}),
+                                 415)
+        stream = buffered(request.stream)
+        records = csv_records(stream) if body_format == 'csv' else ndjson_records(stream)
+        report = import_records(records, task_import_schema, import_tasks,
+                                chunk_size=current_app.config['TASKS_IMPORT_CHUNK_SIZE'],
+                                max_errors=current_app.config['TASKS_IMPORT_MAX_ERRORS'])
+        return report.to_dict()
+
+
+def parse_task_id(value):
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise ValueError(f'Invalid task id: {value}')
+    return value
+
+
+class TaskBulkAPI(Resource):
+    """Create, update and delete many tasks in one transaction
+
+    Body: {"create": [{task}, ...], "update": [{"id": 1, task}, ...], "delete": [1, 2, ...]}
+    Every section is optional. The response holds one result per item, in request order.
+    """
+    decorators = [auth.login_required]
+
+    def post(self):
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return make_response(jsonify({'message': 'Request body must be a JSON object'}), 400)
+
+        sections = {name: body.get(name) or [] for name in ('create', 'update', 'delete')}
+        if not all(isinstance(items, list) for items in sections.values()):
+            return make_response(jsonify({'message': 'create, update and delete must be arrays'}), 400)
+        max_items = current_app.config['TASKS_BULK_MAX_ITEMS']
+        if sum(len(items) for items in sections.values()) > max_items:
+            return make_response(jsonify({'message': f'Too many items, the limit is {max_items}'}), 413)
+
+        results = {name: [None] * len(items) for name, items in sections.items()}
+        now = datetime.utcnow().replace(microsecond=0)
+        owner = current_owner()
+
+        creates = []
+        for i, item in enumerate(sections['create']):
+            try:
+                args = task_create_schema.parse(item)
+            except ValueError as e:
+                results['create'][i] = {'status': 400, 'message': str(e)}
+                continue
+            creates.append((i, {'owner': owner, 'title': args['title'], 'description': args['description'],
+                                'completed': False, 'created_at': now}))
+
+        updates, updated_ids = [], set()
+        for i, item in enumerate(sections['update']):
+            try:
+                task_id = parse_task_id(item.get('id') if isinstance(item, dict) else None)
+                args = task_update_schema.parse(item)
+            except ValueError as e:
+                results['update'][i] = {'status': 400, 'message': str(e)}
+                continue
+            # a second UPDATE of a row would fail the version check of the bulk UPDATE and with it the whole request
+            if task_id in updated_ids:
+                results['update'][i] = {'id': task_id, 'status': 400,
+                                        'message': f'Task with id {task_id} is updated more than once'}
+                continue
+            updated_ids.add(task_id)
+            updates.append((i, {'id': task_id, 'title': args['title'], 'description': args['description'],
+                                'completed': bool(args['completed']), 'updated_at': now}))
+
+        deletes = []
+        for i, item in enumerate(sections['delete']):
+            try:
+                deletes.append((i, parse_task_id(item)))
+            except ValueError as e:
+                results['delete'][i] = {'status': 400, 'message': str(e)}
+
+        try:
+            for task_id, (i, row), change_seq in zip(allocate_task_ids(len(creates)), creates,
+                                                     change_seqs(owner, len(creates))):
+                row.update(id=task_id, change_seq=change_seq)
+                results['create'][i] = {'id': task_id, 'status': 201}
+            if creates:
+                db.session.execute(insert(Tasks), [row for _, row in creates])
+
+            # read after the creates, so updates and deletes of this request find the tasks it created
+            requested_ids = {row['id'] for _, row in updates} | {task_id for _, task_id in deletes}
+            existing = {row.id: row for row in db.session.execute(
+                select(Tasks.id, Tasks.version, Tasks.completed, Tasks.created_at)
+                .where(Tasks.owner == owner, Tasks.id.in_(requested_ids)))} if requested_ids else {}
+            existing_ids = {task_id: row.version for task_id, row in existing.items()}
+
+            found_updates = [dict(row, version=existing_ids[row['id']]) for _, row in updates
+                             if row['id'] in existing_ids]
+            found_deletes = {task_id for _, task_id in deletes if task_id in existing_ids}
+            change_seq_iter = iter(change_seqs(owner, len(found_updates) + len(found_deletes)))
+
+            if found_updates:
+                for row in found_updates:
+                    row['change_seq'] = next(change_seq_iter)
+                db.session.execute(update(Tasks), found_updates)
+            for i, row in updates:
+                results['update'][i] = {'id': row['id'], 'status': 200} if row['id'] in existing_ids \
+                    else {'id': row['id'], 'status': 404, 'message': f"Task with id {row['id']} not found"}
+
+            if found_deletes:
+                db.session.execute(delete(Tasks).where(Tasks.id.in_(found_deletes)))
+                db.session.execute(insert(TaskTombstones), tombstones(found_deletes, change_seq_iter, owner))
+            for i, task_id in deletes:
+                results['delete'][i] = {'id': task_id, 'status': 200} if task_id in found_deletes \
+                    else {'id': task_id, 'status': 404, 'message': f'Task with id {task_id} not found'}
+
+            completed = {task_id: bool(row.completed) for task_id, row in existing.items()}
+            completed_change = 0
+            for row in found_updates:
+                completed_change += int(row['completed']) - int(completed[row['id']])
+                completed[row['id']] = row['completed']
+            created = {now.date(): len(creates)}
+            for task_id in found_deletes:
+                completed_change -= int(completed[task_id])
+                created_on = existing[task_id].created_at.date()
+                created[created_on] = created.get(created_on, 0) - 1
+            count_task_changes(owner, total=len(creates) - len(found_deletes), completed=completed_change,
+                               created=created)
+            db.session.commit()
+        except DataError as e:
+            db.session.rollback()
+            raise DataError(params=e.params, orig=e.orig, statement=e.statement)
+        except StaleDataError:
+            db.session.rollback()
+            return make_response(jsonify({'message': 'Tasks were modified concurrently, nothing was applied'}), 409)
+        except BaseException:
+            db.session.rollback()
+            raise
+
+        if creates or found_updates or found_deletes:
+            tasks_committed(saved=[row for _, row in creates] + [dict(row, owner=owner) for row in found_updates],
+                            deleted=found_deletes)
+        return results
+
+
+class TaskAPI(Resource):
+    decorators = [auth.login_required]
 
-    @marshal_with(task_fields)
     def get(self, id):
-        task = Tasks.query.filter_by(id=id).first_or_404(description=f'Task with id {id} not found')
-        return task
+        owner = current_owner()
+        cached = task_cache().get(id)
+        if cached is None:
+            # a write committed during the read deletes the entry, the row read then must not be cached
+            generation = task_cache().generation(id)
+            row = db.session.execute(select(Tasks.owner, Tasks.version, *task_columns).where(Tasks.id == id)).first()
+            if row is None:
+                row = db.session.execute(select(ArchivedTasks.owner, ArchivedTasks.version, *archived_task_columns)
+                                         .where(ArchivedTasks.id == id)).first()
+            if row is not None:
+                cached = {'owner': row[0], 'etag': task_etag(id, row[1]), 'task': serialize_task(row[2:])}
+                # a replica may not have the latest write yet
+                if 'replica' not in db.session.info:
+                    task_cache().set(id, cached, generation)
+        # the tasks of other owners do not exist for this one
+        if cached is None or cached['owner'] != owner:
+            abort(404, message=f'Task with id {id} not found')
+
+        if request.if_none_match.contains_weak(cached['etag']):
+            return not_modified(cached['etag'])
+        return cached['task'], 200, {'ETag': quote_etag(cached['etag'])}
 
-    @marshal_with(task_fields)
     def put(self, id):
-        task = Tasks.query.filter_by(id=id).first_or_404(description=f'Task with id {id} not found')
-        args = self.reqparse.parse_args()
+        args = parse_request(task_update_schema, request_json())
+        # PUT replaces the task, omitted fields are reset
+        return self.update(id, {'title': args['title'], 'description': args['description'],
+                                'completed': bool(args['completed'])})
+
+    def patch(self, id):
+        values = parse_request(task_patch_schema, request_json())
+        if not values:
+            return make_response(jsonify({'message': 'No fields to update'}), 400)
+        return self.update(id, values)
 
+    def update(self, id, values):
+        values['updated_at'] = datetime.utcnow().replace(microsecond=0)
+        owner = current_owner()
+        clause = task_write_clause(id, request.if_match, owner)
         try:
-            task.title = args.get('title', '')
-            task.description = args.get('description', '')
-            task.completed = args.get('completed', False)
-            task.updated_at = datetime.utcnow().replace(microsecond=0)
+            row = None
+            values['change_seq'], = change_seqs(owner)
+            statement = update(Tasks.__table__).where(clause).values(version=Tasks.version + 1, **values)
+            # the completed counter needs the value being replaced, NULL counts as not completed
+            replaced = db.session.execute(select(Tasks.id, Tasks.completed).where(clause).with_for_update()).first() \
+                if 'completed' in values else None
+            if 'completed' not in values or replaced is not None:
+                row = execute_task_write(statement, id)
+            if row is not None and 'completed' in values:
+                count_task_changes(owner, completed=int(bool(values['completed'])) - int(bool(replaced.completed)))
             db.session.commit()
-
         except DataError as e:
             db.session.rollback()
             raise DataError(params=e.params, orig=e.orig, statement=e.statement)
-        except BaseException as e:
+        except BaseException:
             db.session.rollback()
-            return make_response(jsonify({'message': str(e)}), 500)
+            raise
 
-        return task
+        if row is None:
+            abort_unmatched_write(id, owner)
+        task = serialize_task(row[1:])
+        tasks_committed(saved=[dict(task, owner=owner)])
+        return task, 200, {'ETag': quote_etag(task_etag(id, row[0]))}
 
-    @marshal_with(task_fields)
     def delete(self, id):
-        task = Tasks.query.filter_by(id=id).first_or_404(description=f'Task with id {id} not found')
+        owner = current_owner()
+        statement = delete(Tasks.__table__).where(task_write_clause(id, request.if_match, owner))
         try:
-            db.session.delete(task)
+            change_seq, = change_seqs(owner)
+            row = execute_task_write(statement, id)
+            if row is not None:
+                db.session.execute(insert(TaskTombstones), tombstones([id], [change_seq], owner))
+                count_task_changes(owner, total=-1, completed=-int(bool(row.completed)),
+                                   created={row.created_at.date(): -1})
             db.session.commit()
-        except BaseException as e:
+        except BaseException:
             db.session.rollback()
-            return make_response(jsonify({'message': str(e)}), 500)
-        return task
+            raise
+
+        if row is None:
+            abort_unmatched_write(id, owner)
+        tasks_committed(deleted=[id])
+        return serialize_task(row[1:])
+
+
+class TaskSearchAPI(Resource):
+    decorators = [auth.login_required]
+
+    def get(self):
+        args = parse_request(task_search_schema, request.args)
+        limit = min(args['limit'] or current_app.config['TASKS_PAGE_SIZE'],
+                    current_app.config['TASKS_MAX_PAGE_SIZE'])
+
+        # ranked ids of one extra result tell whether there is a next page
+        owner = current_owner()
+        ids = task_search().search(args['q'], limit + 1, args['offset'], owner)
+        rows = db.session.execute(select(*task_columns).where(Tasks.owner == owner, Tasks.id.in_(ids[:limit]))) \
+            .all() if ids else []
+        tasks = {task['id']: task for task in map(serialize_task, rows)}
+        next_offset = args['offset'] + limit if len(ids) > limit else None
+
+        return {'tasks': [tasks[task_id] for task_id in ids[:limit] if task_id in tasks], 'next': next_offset}
+
+
+class CacheStatsAPI(Resource):
+    decorators = [auth.login_required]
+
+    def get(self):
+        return task_cache().stats()
+
+
+class TaskChangesAPI(Resource):
+    decorators = [auth.login_required]
+
+    def get(self):
+        args = parse_request(task_changes_schema, request.args)
+        limit = min(args['limit'] or current_app.config['TASKS_PAGE_SIZE'],
+                    current_app.config['TASKS_MAX_PAGE_SIZE'])
+        if cursor_expired(db.session, args['since'], current_owner()):
+            abort(410, message=f"Changes since {args['since']} are no longer kept, start over with since=0")
+        return read_changes(db.session, args['since'], limit, current_owner())
+
+
+class TaskStatsAPI(Resource):
+    decorators = [auth.login_required]
+
+    def get(self):
+        return task_stats().read(db.session, current_owner())
+
+
+class TokenAPI(Resource):
+    decorators = [basic_auth.login_required]
+
+    def post(self):
+        """Exchange Basic credentials for a bearer token"""
+        return {'token': authenticator().issue_token(basic_auth.current_user()),
+                'expires_in': current_app.config['AUTH_TOKEN_TTL']}
+
+
+class MetricsAPI(Resource):
+    decorators = [auth.login_required]
+
+    def get(self):
+        return Response(current_app.extensions['task_metrics'].render(), content_type=METRICS_CONTENT_TYPE)
+
+
+class TodoRequest(Request):
+    @property
+    def max_content_length(self):
+        """MAX_CONTENT_LENGTH, except for the streamed body of POST /todo/import"""
+        if self.endpoint == 'tasks_import' and current_app:
+            return current_app.config['TASKS_IMPORT_MAX_CONTENT_LENGTH']
+        return super(TodoRequest, self).max_content_length
+
+
+class TodoApi(Api):
+    def handle_error(self, e):
+        """Leave database errors to the handlers of error_handlers.py, which log them and hide the SQL
+
+        Flask-RESTful answers the errors of its resources itself unless this raises, and it only raises with
+        PROPAGATE_EXCEPTIONS (as under TESTING).
+        """
+        if isinstance(e, SQLAlchemyError):
+            raise e
+        return super(TodoApi, self).handle_error(e)
 
 
 def create_app(config_module):
     app = Flask(__name__)
+    app.request_class = TodoRequest
     app.config.from_object(config_module)
+    QueueLogging.from_config(app.config).init_app(app)
 
+    app.extensions['replica_binds'] = replica_bind_keys(app)
+    shard_binds = shard_bind_keys(app)
     db.init_app(app)
-    api = Api(app)
+    # replicas copy the schema of the primary, create_all and drop_all must not touch them
+    for key in app.extensions['replica_binds']:
+        db.metadatas.pop(key, None)
+    app.extensions['task_id_allocator'] = IdAllocator(Tasks, app.config['TASKS_ID_BLOCK_SIZE'])
+    app.extensions['task_cache'] = app.config['TASKS_CACHE_BACKEND'](app.config)
+    app.extensions['authenticator'] = Authenticator.from_config(app.config)
+    app.extensions['task_stats'] = TaskStats.from_config(app.config)
+    if shard_binds:
+        shards = TaskShards(shard_binds, app.config['TASKS_SHARD_POINTS']).init_app(app, current_owner)
+        app.extensions['task_writer'] = GroupCommitWriter.from_config(
+            app, insert_tasks, partition=lambda row: shards.bind_key(row['owner']))
+    else:
+        app.extensions['task_writer'] = GroupCommitWriter.from_config(app, insert_tasks)
+    database_backend = make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+    app.extensions['task_search'] = FullTextSearch() if database_backend == 'mysql' else InvertedIndex()
+    with app.app_context():
+        Metrics.from_config(app.config).init_app(app, db.engines)
+        Admission.from_config(app.config).init_app(app, client_key)
+        jobs = ProcessJobs().init_app(app)
+        # every shard has statistics, tombstones and archive of its own
+        for engine in task_engines(app):
+            if app.config['TASKS_STATS_RECONCILE_SECONDS']:
+                jobs.add_once(start_reconciler, app, engine, app.config['TASKS_STATS_RECONCILE_SECONDS'])
+            if app.config['TASKS_TOMBSTONE_PRUNE_SECONDS']:
+                jobs.add(start_pruner, engine, app.config['TASKS_TOMBSTONE_PRUNE_SECONDS'],
+                         app.config['TASKS_TOMBSTONE_TTL'])
+            if app.config['TASKS_ARCHIVE_SECONDS']:
+                jobs.add(start_archiver, app, engine, app.config['TASKS_ARCHIVE_SECONDS'],
+                         app.config['TASKS_ARCHIVE_AGE'], app.config['TASKS_ARCHIVE_BATCH_SIZE'],
+                         partial(tasks_archived, engine=engine))
+    api = TodoApi(app)
     register_error_handlers(app)
 
     api.add_resource(TaskListAPI, '/todo', endpoint='tasks')
+    api.add_resource(TaskExportAPI, '/todo/export', endpoint='tasks_export')
+    api.add_resource(TaskBulkAPI, '/todo/bulk', endpoint='tasks_bulk')
+    api.add_resource(TaskImportAPI, '/todo/import', endpoint='tasks_import')
+    api.add_resource(TaskSearchAPI, '/todo/search', endpoint='tasks_search')
+    api.add_resource(TaskStatsAPI, '/todo/stats', endpoint='tasks_stats')
+    api.add_resource(TaskChangesAPI, '/todo/changes', endpoint='tasks_changes')
     api.add_resource(TaskAPI, '/todo/<int:id>', endpoint='task')
+    api.add_resource(CacheStatsAPI, '/todo/cache', endpoint='task_cache')
+    api.add_resource(TokenAPI, '/todo/token', endpoint='token')
+    api.add_resource(MetricsAPI, '/metrics', endpoint='metrics')
 
     return app
 
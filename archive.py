@@ -0,0 +1,73 @@
+"""Archive of completed tasks, the archived_tasks table
+
+Completed tasks that have not changed for `age` seconds move out of the tasks table, so the table behind the list,
+its indexes and the search index hold the open and recent tasks only. GET /todo/<id> falls back to the archive and
+the lists read it with include_archived=true; archived tasks keep their id, version and change number.
+
+Tasks move in batches, each in its own short transaction. A batch is selected with FOR UPDATE SKIP LOCKED (where
+the database supports it), so the archiver passes over rows that requests are writing instead of waiting for them,
+and a request waits at most for the commit of one batch.
+
+Run it once, with the settings of DevelopmentConfig:
+    python3 archive.py
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, and_, or_, literal, true
+from models import Tasks, ArchivedTasks
+from jobs import start_periodic_job
+
+ARCHIVED_COLUMNS = [column.key for column in Tasks.__table__.columns]
+
+
+def archive_batch(connection, cutoff, batch_size):
+    """Move up to `batch_size` completed tasks last changed before `cutoff` to the archive, return their ids"""
+    unchanged = or_(Tasks.updated_at < cutoff, and_(Tasks.updated_at.is_(None), Tasks.created_at < cutoff))
+    task_ids = connection.scalars(select(Tasks.id).where(Tasks.completed == true(), unchanged).order_by(Tasks.id)
+                                  .limit(batch_size).with_for_update(skip_locked=True)).all()
+    if task_ids:
+        archived_at = literal(datetime.utcnow().replace(microsecond=0), ArchivedTasks.archived_at.type)
+        rows = select(*[Tasks.__table__.c[name] for name in ARCHIVED_COLUMNS], archived_at) \
+            .where(Tasks.id.in_(task_ids))
+        connection.execute(insert(ArchivedTasks).from_select(ARCHIVED_COLUMNS + ['archived_at'], rows))
+        connection.execute(delete(Tasks).where(Tasks.id.in_(task_ids)))
+    return task_ids
+
+
+def archive_tasks(engine, age, batch_size=1000, on_archived=None):
+    """Archive the completed tasks unchanged for `age` seconds, one transaction per batch, return how many moved
+
+    `on_archived(task_ids)` is called after every committed batch.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=age)
+    moved = 0
+    while True:
+        with engine.begin() as connection:
+            task_ids = archive_batch(connection, cutoff, batch_size)
+        moved += len(task_ids)
+        if task_ids and on_archived is not None:
+            on_archived(task_ids)
+        # a short batch is the last one, rows skipped because they were locked wait for the next run
+        if len(task_ids) < batch_size:
+            return moved
+
+
+def start_archiver(app, engine, interval, age, batch_size, on_archived=None):
+    """Archive tasks now and then every `interval` seconds, in a daemon thread of this process"""
+    def archive():
+        with app.app_context():
+            archive_tasks(engine, age, batch_size, on_archived)
+
+    return start_periodic_job('task-archiver', interval, archive)
+
+
+if __name__ == '__main__':
+    from functools import partial
+    from app import create_app, tasks_archived
+    from sharding import task_engines
+    from configmodule import DevelopmentConfig
+
+    app = create_app(DevelopmentConfig)
+    with app.app_context():
+        count = sum(archive_tasks(engine, app.config['TASKS_ARCHIVE_AGE'], app.config['TASKS_ARCHIVE_BATCH_SIZE'],
+                                  partial(tasks_archived, engine=engine)) for engine in task_engines(app))
+    print(f'Archived {count} tasks')
@@ -0,0 +1,326 @@
+"""Asyncio (ASGI) variant of the task API
+
+Serves the /todo and /todo/<id> contract of app.py - the same Basic and token auth, JSON bodies, ETags and
+error messages - on an asyncio SQLAlchemy engine, so one process keeps thousands of slow clients
+and in-flight queries going instead of one per thread. The MySQL URI of the config is switched
+to the aiomysql driver and SQLite to aiosqlite, or set SQLALCHEMY_ASYNC_DATABASE_URI.
+
+Run it with:
+    python3 asgi_app.py
+    uvicorn --factory asgi_app:create_default_app --host 127.0.0.1 --port 5000
+"""
+import asyncio
+import base64
+import json
+import re
+import time
+import zlib
+from datetime import datetime
+from urllib.parse import parse_qs
+from flask import Config
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError, DataError
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.http import parse_etags, quote_etag
+from app import task_write_clause, page_cursor, next_cursor, task_page_statement, \
+    task_list_schema, task_create_schema, task_update_schema, task_patch_schema
+from models import Tasks, ArchivedTasks, TaskTombstones, task_columns, archived_task_columns, serialize_task
+from id_allocator import AsyncIdAllocator
+from validation import ValidationError
+from credentials import Authenticator
+from stats import TaskStats
+from changes import take_change_seqs_async, tombstones
+from versioning import task_etag, tasks_version_async
+from error_handlers import log_db_error
+from logs import QueueLogging
+from config import HOST, PORT
+import configmodule
+
+
+ASYNC_DRIVERS = {'mysql': 'mysql+aiomysql', 'sqlite': 'sqlite+aiosqlite'}
+TASKS_PATH = re.compile(r'^/todo/?$')
+TASK_PATH = re.compile(r'^/todo/(\d+)$')
+
+
+def async_database_uri(config):
+    if config.get('SQLALCHEMY_ASYNC_DATABASE_URI'):
+        return config['SQLALCHEMY_ASYNC_DATABASE_URI']
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class Request(object):
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope['query_string']
+        self.args = {key: values[0] for key, values in parse_qs(self.query_string.decode()).items()}
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.body = body
+        # the authenticated user, the owner of the tasks the request reads and writes
+        self.user = None
+        self.if_match = parse_etags(self.headers.get('if-match'))
+        self.if_none_match = parse_etags(self.headers.get('if-none-match'))
+
+    def json(self):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            raise HTTPError(400, 'Failed to decode JSON object')
+
+
+def request_fields(request, start):
+    """Fields of a request for the log record of its error, as error_handlers.request_fields gives them"""
+    task_path = TASK_PATH.match(request.path)
+    endpoint = 'task' if task_path else 'tasks' if TASKS_PATH.match(request.path) else None
+    return {'endpoint': endpoint, 'method': request.method, 'task_id': int(task_path.group(1)) if task_path else None,
+            'duration_ms': round((time.perf_counter() - start) * 1000, 1)}
+
+
+def parse_args(schema, values):
+    """Validate query arguments or a JSON body, with the error body of app.parse_request"""
+    try:
+        return schema.parse(values)
+    except ValidationError as e:
+        raise HTTPError(400, {e.name: e.message} if e.name else e.message)
+
+
+class TaskASGIApp(object):
+    def __init__(self, config_module):
+        self.config = Config('.')
+        self.config.from_object(config_module)
+        if self.config.get('SQLALCHEMY_SHARD_URIS'):
+            raise RuntimeError('The ASGI app does not support SQLALCHEMY_SHARD_URIS, serve sharded tasks with app.py')
+        QueueLogging.from_config(self.config).install()
+        options = dict(self.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        self.engine = create_async_engine(async_database_uri(self.config), **options)
+        self.authenticator = Authenticator.from_config(self.config)
+        self.stats = TaskStats.from_config(self.config)
+        self.id_allocator = AsyncIdAllocator(Tasks, self.config['TASKS_ID_BLOCK_SIZE'], self.engine)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        start = time.perf_counter()
+        body = b''
+        max_length = self.config.get('MAX_CONTENT_LENGTH')
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if max_length is not None and len(body) > max_length:
+                return await self.send(send, 413, {'message': 'Request body too large'})
+            if not message.get('more_body'):
+                break
+
+        request = Request(scope, body)
+        try:
+            status, data, headers = await self.dispatch(request)
+        except HTTPError as e:
+            status, data, headers = e.status, {'message': e.message}, e.headers
+        except DataError as e:
+            log_db_error(e, **request_fields(request, start))
+            status, data, headers = 500, {'message': f'Database error: {e.orig}'}, {}
+        except SQLAlchemyError as e:
+            log_db_error(e, **request_fields(request, start))
+            status, data, headers = 500, {'message': 'Database error'}, {}
+        await self.send(send, status, data, headers)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def send(send, status, data, headers=None):
+        # same bytes as the JSON representation of Flask-RESTful
+        body = b'' if data is None else (json.dumps(data) + '\n').encode()
+        response_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        response_headers += [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def dispatch(self, request):
+        await self.authenticate(request)
+
+        if TASKS_PATH.match(request.path):
+            handlers = {'GET': self.list_tasks, 'POST': self.create_task}
+            args = ()
+        elif TASK_PATH.match(request.path):
+            handlers = {'GET': self.get_task, 'PUT': self.put_task, 'PATCH': self.patch_task,
+                        'DELETE': self.delete_task}
+            args = (int(TASK_PATH.match(request.path).group(1)),)
+        else:
+            raise HTTPError(404, 'The requested URL was not found on the server.')
+
+        handler = handlers.get(request.method)
+        if handler is None:
+            raise HTTPError(405, 'The method is not allowed for the requested URL.')
+        return await handler(request, *args)
+
+    async def authenticate(self, request):
+        scheme, _, credentials = request.headers.get('authorization', '').partition(' ')
+        user = None
+        if scheme.lower() == 'basic':
+            try:
+                username, _, password = base64.b64decode(credentials).decode().partition(':')
+            except ValueError:
+                username = password = None
+            # hashing a password takes milliseconds, keep it off the event loop
+            user = self.authenticator.verified(username, password) or \
+                await asyncio.to_thread(self.authenticator.check_password, username, password)
+        elif scheme.lower() == 'bearer':
+            user = self.authenticator.verify_token(credentials.strip())
+        if user is None:
+            raise HTTPError(403, 'Unauthorized access')
+        request.user = user
+
+    async def list_tasks(self, request):
+        args = dict(parse_args(task_list_schema, request.args), owner=request.user)
+        limit = min(args['limit'] or self.config['TASKS_PAGE_SIZE'], self.config['TASKS_MAX_PAGE_SIZE'])
+        try:
+            after = page_cursor(args)
+        except ValidationError as e:
+            raise HTTPError(400, {e.name: e.message})
+
+        async with self.engine.connect() as connection:
+            version = await tasks_version_async(connection, request.user)
+            etag = f"tasks.{version}.{zlib.crc32(request.user.encode() + b'?' + request.query_string)}"
+            if request.if_none_match.contains_weak(etag):
+                return 304, None, {'ETag': quote_etag(etag)}
+
+            rows = (await connection.execute(task_page_statement(args, limit + 1, after))).all()
+
+        tasks = [serialize_task(row) for row in rows[:limit]]
+        next_page = next_cursor(args, rows[limit - 1]) if len(rows) > limit else None
+        return 200, {'tasks': tasks, 'next': next_page}, {'ETag': quote_etag(etag)}
+
+    async def get_task(self, request, id):
+        async with self.engine.connect() as connection:
+            row = (await connection.execute(select(Tasks.version, *task_columns)
+                                            .where(Tasks.id == id, Tasks.owner == request.user))).first()
+            if row is None:
+                archived = ArchivedTasks.id == id, ArchivedTasks.owner == request.user
+                row = (await connection.execute(select(ArchivedTasks.version, *archived_task_columns)
+                                                .where(*archived))).first()
+        if row is None:
+            raise HTTPError(404, f'Task with id {id} not found')
+        etag = task_etag(id, row[0])
+        if request.if_none_match.contains_weak(etag):
+            return 304, None, {'ETag': quote_etag(etag)}
+        return 200, serialize_task(row[1:]), {'ETag': quote_etag(etag)}
+
+    async def create_task(self, request):
+        args = parse_args(task_create_schema, request.json() or {})
+        task_id, = await self.id_allocator.allocate()
+        values = {'id': task_id, 'owner': request.user, 'title': args['title'], 'description': args['description'],
+                  'completed': False, 'created_at': datetime.utcnow().replace(microsecond=0)}
+        async with self.engine.begin() as connection:
+            values['change_seq'], = await take_change_seqs_async(connection, request.user)
+            await connection.execute(insert(Tasks.__table__).values(version=1, **values))
+            await self.count_changes(connection, request.user, total=1, created={values['created_at'].date(): 1})
+
+        task = serialize_task(tuple(values.get(column.key) for column in task_columns))
+        return 200, task, {'ETag': quote_etag(task_etag(task_id, 1))}
+
+    async def put_task(self, request, id):
+        args = parse_args(task_update_schema, request.json() or {})
+        return await self.update_task(request, id, {'title': args.get('title'), 'description': args.get('description'),
+                                                    'completed': bool(args.get('completed'))})
+
+    async def patch_task(self, request, id):
+        values = parse_args(task_patch_schema, request.json() or {})
+        if not values:
+            raise HTTPError(400, 'No fields to update')
+        return await self.update_task(request, id, values)
+
+    async def update_task(self, request, id, values):
+        values['updated_at'] = datetime.utcnow().replace(microsecond=0)
+        clause = task_write_clause(id, request.if_match, request.user)
+        returned = (Tasks.version, *task_columns)
+        async with self.engine.begin() as connection:
+            row = None
+            values['change_seq'], = await take_change_seqs_async(connection, request.user)
+            statement = update(Tasks.__table__).where(clause).values(version=Tasks.version + 1, **values)
+            # the completed counter needs the value being replaced, NULL counts as not completed
+            replaced = (await connection.execute(select(Tasks.id, Tasks.completed).where(clause)
+                                                 .with_for_update())).first() if 'completed' in values else None
+            if 'completed' not in values or replaced is not None:
+                if connection.dialect.update_returning:
+                    row = (await connection.execute(statement.returning(*returned))).first()
+                elif (await connection.execute(statement)).rowcount:
+                    row = (await connection.execute(select(*returned).where(Tasks.id == id))).first()
+            if row is not None and 'completed' in values:
+                await self.count_changes(connection, request.user,
+                                         completed=int(bool(values['completed'])) - int(bool(replaced.completed)))
+        if row is None:
+            await self.raise_unmatched_write(id, request.user)
+
+        return 200, serialize_task(row[1:]), {'ETag': quote_etag(task_etag(id, row[0]))}
+
+    async def delete_task(self, request, id):
+        statement = delete(Tasks.__table__).where(task_write_clause(id, request.if_match, request.user))
+        returned = (Tasks.version, *task_columns)
+        async with self.engine.begin() as connection:
+            change_seq, = await take_change_seqs_async(connection, request.user)
+            if connection.dialect.delete_returning:
+                row = (await connection.execute(statement.returning(*returned))).first()
+            else:
+                row = (await connection.execute(select(*returned).where(statement.whereclause)
+                                                .with_for_update())).first()
+                if row is not None:
+                    await connection.execute(statement)
+            if row is not None:
+                await connection.execute(insert(TaskTombstones), tombstones([id], [change_seq], request.user))
+                await self.count_changes(connection, request.user, total=-1, completed=-int(bool(row.completed)),
+                                         created={row.created_at.date(): -1})
+        if row is None:
+            await self.raise_unmatched_write(id, request.user)
+
+        return 200, serialize_task(row[1:]), {}
+
+    async def count_changes(self, connection, owner, total=0, completed=0, created=None):
+        statement = self.stats.increment(connection.dialect.name, owner, total, completed, created)
+        if statement is not None:
+            await connection.execute(statement)
+
+    async def raise_unmatched_write(self, task_id, owner):
+        async with self.engine.connect() as connection:
+            exists = await connection.scalar(select(Tasks.id).where(Tasks.id == task_id, Tasks.owner == owner))
+            archived = exists is None and await connection.scalar(
+                select(ArchivedTasks.id).where(ArchivedTasks.id == task_id, ArchivedTasks.owner == owner)) is not None
+        if archived:
+            raise HTTPError(409, f'Task with id {task_id} is archived')
+        if exists is None:
+            raise HTTPError(404, f'Task with id {task_id} not found')
+        raise HTTPError(412, f'Task with id {task_id} has been modified')
+
+
+def create_asgi_app(config_module):
+    return TaskASGIApp(config_module)
+
+
+def create_default_app():
+    return create_asgi_app(configmodule.DevelopmentConfig)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(create_default_app(), host=HOST, port=int(PORT))
@@ -0,0 +1,209 @@
+"""Load benchmark of the REST endpoints
+
+Builds the app with configmodule.BenchmarkConfig (a local SQLite file), seeds tasks and drives every scenario from a
+pool of threads through the Flask test client, so the numbers cover the app and the database but not the network.
+Prints throughput and p50/p95/p99 latency (ms) as JSON and exits with 1 when a scenario is slower than the baseline
+by more than the threshold.
+
+    python3 benchmark.py --tasks 10000 --requests 2000 --concurrency 8 --save-baseline benchmark_baseline.json
+    python3 benchmark.py --tasks 10000 --requests 2000 --concurrency 8 --baseline benchmark_baseline.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import event, insert
+from sqlalchemy.engine import make_url
+from app import create_app
+from models import db, Tasks
+from config import LOGIN, PASSWORD
+import configmodule
+
+SCENARIOS = ('list', 'get', 'post', 'put', 'delete', 'reject')
+# scenarios whose requests are meant to fail, with the status they must get
+EXPECTED_STATUS = {'reject': 400}
+SEED_CHUNK_SIZE = 1000
+WARMUP_REQUESTS = 50
+
+
+def enable_wal(dbapi_connection, connection_record):
+    # readers do not wait for the writer
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.close()
+
+
+def create_benchmark_app(config_module=configmodule.BenchmarkConfig):
+    """Create the app on an empty database"""
+    url = make_url(config_module.SQLALCHEMY_DATABASE_URI)
+    if url.get_backend_name() == 'sqlite' and url.database:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(url.database + suffix):
+                os.remove(url.database + suffix)
+
+    app = create_app(config_module)
+    with app.app_context():
+        if url.get_backend_name() == 'sqlite':
+            event.listen(db.engine, 'connect', enable_wal)
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def seed_tasks(app, count):
+    """Insert tasks 1..count and return their ids"""
+    created_at = datetime.utcnow().replace(microsecond=0)
+    with app.app_context():
+        for start in range(1, count + 1, SEED_CHUNK_SIZE):
+            db.session.execute(insert(Tasks), [
+                {'id': i, 'owner': LOGIN, 'title': f'Task {i}', 'description': f'Benchmark task number {i}',
+                 'completed': i % 2 == 0, 'created_at': created_at, 'version': 1}
+                for i in range(start, min(start + SEED_CHUNK_SIZE, count + 1))])
+        db.session.commit()
+    return list(range(1, count + 1))
+
+
+def scenario_calls(scenario, count, task_ids, delete_ids, rng):
+    """Return `count` requests of a scenario as (method, path, json body) tuples"""
+    if scenario == 'list':
+        return [('GET', f'/todo?limit=50&after={rng.choice(task_ids)}', None) for _ in range(count)]
+    if scenario == 'get':
+        return [('GET', f'/todo/{rng.choice(task_ids)}', None) for _ in range(count)]
+    if scenario == 'post':
+        return [('POST', '/todo', {'title': f'New task {i}', 'description': 'Created by the benchmark'})
+                for i in range(count)]
+    if scenario == 'put':
+        return [('PUT', f'/todo/{rng.choice(task_ids)}', {'title': f'Updated task {i}', 'description': 'Updated',
+                                                         'completed': True}) for i in range(count)]
+    if scenario == 'delete':
+        return [('DELETE', f'/todo/{delete_ids.pop()}', None) for _ in range(count)]
+    if scenario == 'reject':
+        # invalid bodies and query arguments, answered by the request validation without touching the database
+        return [('POST', '/todo', {'description': 'No title', 'completed': 'maybe'}) if i % 2 else
+                ('GET', '/todo?limit=0&sort=id', None) for i in range(count)]
+    raise ValueError(f'Unknown scenario {scenario}')
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list"""
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def run_scenario(app, calls, concurrency, expected_status=None):
+    """Run the calls, responses count as errors when their status is >= 400 or not `expected_status`"""
+    local = threading.local()
+
+    def timed(call):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        method, path, body = call
+        start = time.perf_counter()
+        response = local.client.open(path, method=method, json=body, auth=(LOGIN, PASSWORD))
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        response.close()
+        if expected_status is not None:
+            return elapsed, response.status_code == expected_status
+        return elapsed, response.status_code < 400
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, calls))
+    seconds = time.perf_counter() - start
+
+    latencies = sorted(elapsed * 1000 for elapsed, ok in results)
+    return {
+        'requests': len(results),
+        'errors': sum(1 for elapsed, ok in results if not ok),
+        'seconds': round(seconds, 3),
+        'throughput': round(len(results) / seconds, 1),
+        'p50': round(percentile(latencies, 50), 3),
+        'p95': round(percentile(latencies, 95), 3),
+        'p99': round(percentile(latencies, 99), 3),
+    }
+
+
+def run_benchmark(tasks=10000, requests=2000, concurrency=8, scenarios=SCENARIOS, seed=0,
+                  config_module=configmodule.BenchmarkConfig):
+    """Seed `tasks` tasks, run `requests` requests of every scenario and return the report"""
+    rng = random.Random(seed)
+    app = create_benchmark_app(config_module)
+    warmup = min(WARMUP_REQUESTS, requests)
+    # delete only tasks that nothing else touches
+    delete_count = requests + warmup if 'delete' in scenarios else 0
+    task_ids = seed_tasks(app, tasks + delete_count)
+    delete_ids = task_ids[tasks:]
+    task_ids = task_ids[:tasks]
+
+    results = {}
+    for scenario in scenarios:
+        expected_status = EXPECTED_STATUS.get(scenario)
+        run_scenario(app, scenario_calls(scenario, warmup, task_ids, delete_ids, rng), concurrency, expected_status)
+        results[scenario] = run_scenario(app, scenario_calls(scenario, requests, task_ids, delete_ids, rng),
+                                         concurrency, expected_status)
+    return {
+        'config': {'tasks': tasks, 'requests': requests, 'concurrency': concurrency, 'seed': seed,
+                   'database': make_url(config_module.SQLALCHEMY_DATABASE_URI).get_backend_name(),
+                   'python': sys.version.split()[0]},
+        'results': results,
+    }
+
+
+def compare_results(results, baseline, threshold):
+    """Return a message for every scenario whose throughput or p95 is worse than the baseline by more than threshold"""
+    regressions = []
+    for scenario, result in results.items():
+        base = baseline.get(scenario)
+        if base is None:
+            continue
+        if result['throughput'] < base['throughput'] * (1 - threshold):
+            regressions.append(f"{scenario}: throughput {result['throughput']} req/s, baseline {base['throughput']}")
+        if result['p95'] > base['p95'] * (1 + threshold):
+            regressions.append(f"{scenario}: p95 {result['p95']} ms, baseline {base['p95']}")
+        if result['errors'] > base['errors']:
+            regressions.append(f"{scenario}: {result['errors']} errors, baseline {base['errors']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the REST endpoints')
+    parser.add_argument('--tasks', type=int, default=10000, help='tasks seeded before the run')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated, of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random task ids')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed regression, 0.2 is 20%%')
+    parser.add_argument('--save-baseline', help='write the report to this file')
+    args = parser.parse_args(argv)
+
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(',') if scenario.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = run_benchmark(args.tasks, args.requests, args.concurrency, scenarios, args.seed)
+    print(json.dumps(report, indent=2))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(report['results'], baseline['results'], args.threshold)
+        for regression in regressions:
+            print(f'Regression {regression}', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class CacheBackend(object):
+    """Interface of the task cache, implement it to put the cache into a shared store
+
+    Values are serialized task payloads (plain dicts), keys are task ids.
+    """
+
+    def get(self, key):
+        """Return the cached value or None"""
+        raise NotImplementedError
+
+    def generation(self, key):
+        """Return a token to pass to set when filling the entry from a read made after this call"""
+        raise NotImplementedError
+
+    def set(self, key, value, generation=None):
+        """Store the value, unless `key` was deleted since `generation` was taken: the value may be older"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        """Return counters as a dict: hits, misses, evictions, size"""
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """In-process LRU cache with a time to live for each entry
+
+    Every process has its own copy, so writes made by other processes become visible here
+    only when the entry expires. Keep `ttl` short or use a shared backend with several workers.
+    """
+
+    def __init__(self, max_size=10000, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # generation of the last delete of the latest `max_size` deleted keys; those forgotten were deleted
+        # at or before generation _forgotten
+        self._deletes = 0
+        self._deleted = OrderedDict()
+        self._forgotten = 0
+        self._lock = Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(max_size=config['TASKS_CACHE_SIZE'], ttl=config['TASKS_CACHE_TTL'])
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, key):
+        with self._lock:
+            return self._deletes
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and self._deleted.get(key, self._forgotten) > generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._deletes += 1
+            self._deleted[key] = self._deletes
+            self._deleted.move_to_end(key)
+            while len(self._deleted) > self.max_size:
+                self._forgotten = self._deleted.popitem(last=False)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'size': len(self._entries), 'max_size': self.max_size}
+
+
+class NullCache(CacheBackend):
+    """Cache that stores nothing, to switch caching off"""
+
+    def __init__(self):
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls()
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def generation(self, key):
+        return None
+
+    def set(self, key, value, generation=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {'hits': 0, 'misses': self.misses, 'evictions': 0, 'size': 0}
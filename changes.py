@@ -0,0 +1,145 @@
+"""Change feed of the tasks table, GET /todo/changes?since=<cursor>
+
+Every owner has a feed of its own. A write takes increasing numbers from the counter of the owner,
+tasks_change_seq.<owner>, for the rows it touches and stores them in Tasks.change_seq; a delete leaves a row with
+its number in task_tombstones. The counter row stays locked until the write commits, so the writes of an owner
+become visible in the order of their numbers and a reader that saw number n has seen every number of the owner
+below it, while writes of different owners do not wait on each other. A poll reads the rows of its owner after the
+cursor through the (owner, change_seq) indexes, so its cost grows with the number of changes, not with the size of
+the table.
+"""
+from datetime import datetime, timedelta
+from operator import itemgetter
+from sqlalchemy import select, delete, func, case
+from sqlalchemy.dialects import mysql
+from models import Tasks, ArchivedTasks, Sequences, TaskTombstones, task_columns, archived_task_columns, \
+    serialize_task
+from stats import UPSERT_DIALECTS
+from jobs import start_periodic_job
+
+CHANGE_SEQ = 'tasks_change_seq'
+# change_seq of the newest pruned tombstone of an owner, cursors before it can no longer be served
+PRUNED_SEQ = 'tasks_tombstones_pruned'
+
+
+def change_seq_name(owner):
+    return f'{CHANGE_SEQ}.{owner}'
+
+
+def pruned_seq_name(owner):
+    return f'{PRUNED_SEQ}.{owner}'
+
+
+def _upsert(dialect_name, name, insert_value, update_value):
+    dialect = UPSERT_DIALECTS[dialect_name]
+    statement = dialect.insert(Sequences).values(name=name, next_value=insert_value)
+    if dialect is mysql:
+        return statement.on_duplicate_key_update(next_value=update_value)
+    return statement.on_conflict_do_update(index_elements=[Sequences.name], set_={'next_value': update_value})
+
+
+def _take_statement(dialect_name, name, count):
+    if UPSERT_DIALECTS[dialect_name] is mysql:
+        # LAST_INSERT_ID(expr) sends the new value back with the result of the statement, as lastrowid
+        return _upsert(dialect_name, name, func.last_insert_id(count),
+                       func.last_insert_id(Sequences.next_value + count))
+    return _upsert(dialect_name, name, count, Sequences.next_value + count).returning(Sequences.next_value)
+
+
+def _current_statement(name):
+    return select(Sequences.next_value).where(Sequences.name == name)
+
+
+def take_change_seqs(connection, owner, count=1):
+    """Take `count` consecutive change numbers of `owner` in the transaction of `connection`
+
+    Take them before the first write of the transaction, so that every writer locks the counter row first; a
+    transaction writing the tasks of several owners takes them in the order of the owner names.
+    """
+    if not count:
+        return range(0)
+    name = change_seq_name(owner)
+    result = connection.execute(_take_statement(connection.dialect.name, name, count))
+    last = result.scalar() if result.returns_rows else result.lastrowid or connection.scalar(_current_statement(name))
+    return range(last - count + 1, last + 1)
+
+
+async def take_change_seqs_async(connection, owner, count=1):
+    """take_change_seqs on an asyncio connection"""
+    name = change_seq_name(owner)
+    result = await connection.execute(_take_statement(connection.dialect.name, name, count))
+    last = result.scalar() if result.returns_rows else \
+        result.lastrowid or await connection.scalar(_current_statement(name))
+    return range(last - count + 1, last + 1)
+
+
+def advance_change_seqs(connection, owner, change_seq, pruned_seq=None):
+    """Raise the counter of `owner` to at least `change_seq` and its pruned number to at least `pruned_seq`
+
+    Used when the rows of an owner move to another database, so that its feed goes on from the numbers seen there.
+    """
+    counters = {change_seq_name(owner): change_seq, pruned_seq_name(owner): pruned_seq}
+    for name, value in counters.items():
+        if value is not None:
+            higher = case((Sequences.next_value < value, value), else_=Sequences.next_value)
+            connection.execute(_upsert(connection.dialect.name, name, value, higher))
+
+
+def tombstones(task_ids, change_seqs, owner):
+    """Rows of task_tombstones for deleted task ids of `owner`"""
+    now = datetime.utcnow().replace(microsecond=0)
+    return [{'id': task_id, 'owner': owner, 'change_seq': change_seq, 'deleted_at': now}
+            for task_id, change_seq in zip(task_ids, change_seqs)]
+
+
+def cursor_expired(connection, since, owner):
+    """True when tombstones of `owner` after `since` have been pruned, the client has to start over with since=0"""
+    pruned = connection.scalar(_current_statement(pruned_seq_name(owner)))
+    return since > 0 and pruned is not None and since < pruned
+
+
+def read_changes(connection, since, limit, owner):
+    """Tasks of `owner` created or updated and ids of its tasks deleted after the cursor `since`, oldest first
+
+    Archived tasks keep their change number, archiving a task is not a change.
+    """
+    tasks = connection.execute(select(Tasks.change_seq, *task_columns)
+                               .where(Tasks.owner == owner, Tasks.change_seq > since)
+                               .order_by(Tasks.change_seq).limit(limit + 1)).all()
+    tasks += connection.execute(select(ArchivedTasks.change_seq, *archived_task_columns)
+                                .where(ArchivedTasks.owner == owner, ArchivedTasks.change_seq > since)
+                                .order_by(ArchivedTasks.change_seq).limit(limit + 1)).all()
+    deleted = connection.execute(select(TaskTombstones.change_seq, TaskTombstones.id)
+                                 .where(TaskTombstones.owner == owner, TaskTombstones.change_seq > since)
+                                 .order_by(TaskTombstones.change_seq).limit(limit + 1)).all()
+    changes = sorted([(row.change_seq, serialize_task(row[1:]), None) for row in tasks] +
+                     [(row.change_seq, None, row.id) for row in deleted], key=itemgetter(0))
+    page = changes[:limit]
+    return {
+        'tasks': [task for change_seq, task, task_id in page if task is not None],
+        'deleted': [task_id for change_seq, task, task_id in page if task is None],
+        'cursor': page[-1][0] if page else since,
+        'more': len(changes) > limit,
+    }
+
+
+def prune_tombstones(connection, ttl):
+    """Delete tombstones older than `ttl` seconds and remember the newest pruned change number of every owner"""
+    cutoff = datetime.utcnow() - timedelta(seconds=ttl)
+    pruned = connection.execute(select(TaskTombstones.owner, func.max(TaskTombstones.change_seq))
+                                .where(TaskTombstones.deleted_at < cutoff).group_by(TaskTombstones.owner)).all()
+    deleted = 0
+    for owner, change_seq in pruned:
+        connection.execute(_upsert(connection.dialect.name, pruned_seq_name(owner), change_seq, change_seq))
+        deleted += connection.execute(delete(TaskTombstones).where(TaskTombstones.owner == owner,
+                                                                   TaskTombstones.change_seq <= change_seq)).rowcount
+    return deleted
+
+
+def start_pruner(engine, interval, ttl):
+    """Prune tombstones now and then every `interval` seconds, in a daemon thread of this process"""
+    def prune():
+        with engine.begin() as connection:
+            prune_tombstones(connection, ttl)
+
+    return start_periodic_job('task-tombstone-pruner', interval, prune)
@@ -6,7 +6,11 @@ env = Env()
 env.read_env()
 # Credentials for app flask and user connection
 LOGIN = env("LOGIN")
-PASSWORD = env("PASSWORD")
+PASSWORD = env("PASSWORD", None)
+# werkzeug.security.generate_password_hash of the password, used instead of PASSWORD when set
+PASSWORD_HASH = env("PASSWORD_HASH", None)
+# signs bearer tokens, random per process when unset
+SECRET_KEY = env("SECRET_KEY", None)
 HOST = env("HOST")
 PORT = env("PORT")
 
@@ -17,3 +21,21 @@ DB_PASS = env("DB_PASS")
 DB_HOST = env("DB_HOST")
 DB_PORT = env("DB_PORT")
 
+# Connection pool of every database engine
+DB_POOL_SIZE = env.int("DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = env.int("DB_MAX_OVERFLOW", 20)
+DB_POOL_TIMEOUT = env.int("DB_POOL_TIMEOUT", 10)
+DB_POOL_RECYCLE = env.int("DB_POOL_RECYCLE", 1800)
+DB_POOL_PRE_PING = env.bool("DB_POOL_PRE_PING", True)
+
+# Read replicas, comma separated SQLAlchemy URIs
+DB_REPLICA_URIS = env.list("DB_REPLICA_URIS", [])
+# Shards of the tasks by owner, comma separated name=URI pairs; names must stay the same once tasks are stored
+DB_SHARD_URIS = env.dict("DB_SHARD_URIS", {})
+
+
+# Worker processes of server.py, unset for one per CPU
+SERVER_WORKERS = env.int("SERVER_WORKERS", None)
+
+# Log requests slower than this many seconds with the SQL they ran, unset to switch the log off
+SLOW_REQUEST_SECONDS = env.float("SLOW_REQUEST_SECONDS", None)
@@ -1,13 +1,112 @@
-from config import DB_LOGIN, DB_PASS, DB_PORT, DB_HOST, DB_NAME
+import os
+import tempfile
+from config import LOGIN, PASSWORD, PASSWORD_HASH, SECRET_KEY, DB_LOGIN, DB_PASS, DB_PORT, DB_HOST, DB_NAME, \
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_REPLICA_URIS, \
+    DB_SHARD_URIS, SLOW_REQUEST_SECONDS, SERVER_WORKERS
+from cache import LRUCache, NullCache
 
 
 class Config(object):
     TESTING = False
+    SECRET_KEY = SECRET_KEY
+    # username -> password hash (werkzeug.security.generate_password_hash) or plain password
+    AUTH_USERS = {LOGIN: PASSWORD_HASH or PASSWORD}
+    # lifetime of tokens from POST /todo/token, in seconds
+    AUTH_TOKEN_TTL = 3600
+    # successful password checks remembered for AUTH_CACHE_TTL seconds, so hashes are not recomputed per request
+    AUTH_CACHE_SIZE = 1000
+    AUTH_CACHE_TTL = 300
+    # Request bodies larger than this are refused with 413, before they are read; a full POST /todo/bulk fits
+    MAX_CONTENT_LENGTH = 4 * 1024 * 1024
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # applied to the primary and to every replica engine
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+    # GET and HEAD requests read from one of these, see routing.RoutingSession
+    SQLALCHEMY_REPLICA_URIS = DB_REPLICA_URIS
+    # name -> URI of the databases the tasks are sharded over by owner, see sharding.py; the default database keeps
+    # the id sequence. Every shard is at TASKS_SHARD_POINTS points of the hash ring, more points spread owners evener
+    SQLALCHEMY_SHARD_URIS = DB_SHARD_URIS
+    TASKS_SHARD_POINTS = 100
+    # Page size of GET /todo when no limit is given, and the hard cap on any requested limit
+    TASKS_PAGE_SIZE = 100
+    TASKS_MAX_PAGE_SIZE = 1000
+    # Rows fetched per round trip when streaming GET /todo/export
+    TASKS_EXPORT_CHUNK_SIZE = 1000
+    # Maximum number of create/update/delete items in one POST /todo/bulk
+    TASKS_BULK_MAX_ITEMS = 5000
+    # POST /todo/import: valid records inserted and committed together, the body size limit (None for no limit,
+    # the body is streamed) and the number of rejected records listed in the response
+    TASKS_IMPORT_CHUNK_SIZE = 1000
+    TASKS_IMPORT_MAX_CONTENT_LENGTH = None
+    TASKS_IMPORT_MAX_ERRORS = 1000
+    # Task ids reserved per round trip to the sequences table, see id_allocator.py
+    TASKS_ID_BLOCK_SIZE = 100
+    # Cache of GET /todo/<id> payloads: factory called with the app config, returning a cache.CacheBackend
+    TASKS_CACHE_BACKEND = LRUCache.from_config
+    TASKS_CACHE_SIZE = 10000
+    TASKS_CACHE_TTL = 30
+    # Counter rows per statistic of GET /todo/stats, more rows let more writers count at the same time
+    TASKS_STATS_SLOTS = 8
+    # Recount the statistics every this many seconds (and at start) in one process per server, None switches it off
+    TASKS_STATS_RECONCILE_SECONDS = 600
+    # Tombstones of deleted tasks stay in GET /todo/changes this many seconds, clients polling less often start over
+    TASKS_TOMBSTONE_TTL = 30 * 24 * 3600
+    # Prune expired tombstones every this many seconds (and at the first request) in every process, None switches it off
+    TASKS_TOMBSTONE_PRUNE_SECONDS = 3600
+    # Completed tasks unchanged for TASKS_ARCHIVE_AGE seconds move to the archived_tasks table, BATCH_SIZE tasks per
+    # transaction, every TASKS_ARCHIVE_SECONDS (and at the first request) in every process, None switches it off
+    TASKS_ARCHIVE_AGE = 30 * 24 * 3600
+    TASKS_ARCHIVE_BATCH_SIZE = 1000
+    TASKS_ARCHIVE_SECONDS = 3600
+    # Group commit of POST /todo: a background writer inserts the tasks of concurrent requests with one statement
+    # and one commit, waiting at most MAX_DELAY seconds for a batch of up to MAX_BATCH tasks. Requests whose task is
+    # not committed within TIMEOUT seconds get 503
+    TASKS_GROUP_COMMIT = False
+    TASKS_GROUP_COMMIT_MAX_DELAY = 0.002
+    TASKS_GROUP_COMMIT_MAX_BATCH = 100
+    TASKS_GROUP_COMMIT_TIMEOUT = 10
+    # Admission control, see admission.py, None switches a limit off. Requests per second (and burst) of a user
+    # (of a client address before its credentials are verified), answered with 429 beyond that
+    ADMISSION_RATE = None
+    ADMISSION_BURST = None
+    # reads (GET, HEAD) and writes running at a time, up to MAX_QUEUE more wait QUEUE_TIMEOUT seconds, others get 503
+    ADMISSION_MAX_READS = 64
+    ADMISSION_MAX_WRITES = 32
+    ADMISSION_MAX_QUEUE = 64
+    ADMISSION_QUEUE_TIMEOUT = 1
+    # 503 at once while connections of the pool are waited for longer than this many seconds
+    ADMISSION_MAX_POOL_WAIT = 1
+    ADMISSION_RETRY_AFTER = 1
+    # Requests slower than this are logged with their SQL statements, None switches the log off
+    TASKS_SLOW_REQUEST_SECONDS = SLOW_REQUEST_SECONDS
+    # Log records go through a queue of LOG_QUEUE_SIZE records to JSON lines on stderr, records of a full queue are
+    # dropped; an identical message is logged once per LOG_DEDUP_SECONDS, None logs every one
+    LOG_LEVEL = 'ERROR'
+    LOG_QUEUE_SIZE = 10000
+    LOG_DEDUP_SECONDS = 60
+    # Production server, server.py: SERVER_WORKERS processes (None: one per CPU) of SERVER_THREADS threads each.
+    # A worker is replaced after SERVER_MAX_REQUESTS requests (plus up to JITTER, so they do not all restart
+    # together) or once its peak memory passes SERVER_MAX_MEMORY bytes; on shutdown it finishes its requests
+    # for up to SERVER_GRACEFUL_TIMEOUT seconds and closes its database connections
+    SERVER_WORKERS = SERVER_WORKERS
+    SERVER_THREADS = 8
+    SERVER_MAX_REQUESTS = 10000
+    SERVER_MAX_REQUESTS_JITTER = 1000
+    SERVER_MAX_MEMORY = 512 * 1024 * 1024
+    SERVER_GRACEFUL_TIMEOUT = 30
 
 
 class ProductionConfig(Config):
-    DATABASE_URI = 'mysql+pymysql://user@localhost/foo'
+    SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{DB_LOGIN}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    # server.py runs several worker processes, a write in one does not invalidate the LRUCache of the others;
+    # set a backend shared by the workers to cache GET /todo/<id> again
+    TASKS_CACHE_BACKEND = NullCache.from_config
 
 
 class DevelopmentConfig(Config):
@@ -17,5 +116,18 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     DB_TEST_NAME = "test_mysql_db"
+    # tests recreate the tables between cases, so do not keep ids reserved in memory
+    TASKS_ID_BLOCK_SIZE = 1
+    TASKS_STATS_RECONCILE_SECONDS = None
+    TASKS_TOMBSTONE_PRUNE_SECONDS = None
+    TASKS_ARCHIVE_SECONDS = None
     SQLALCHEMY_DATABASE_URI = f"mysql+pymysql://{DB_LOGIN}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_TEST_NAME}"
     TESTING = True
+
+
+class BenchmarkConfig(Config):
+    # local SQLite file, recreated by every run of benchmark.py
+    SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'todo_benchmark.db')}"
+    SQLALCHEMY_ENGINE_OPTIONS = dict(Config.SQLALCHEMY_ENGINE_OPTIONS, connect_args={'timeout': 30})
+    TASKS_STATS_RECONCILE_SECONDS = None
+    TASKS_TOMBSTONE_PRUNE_SECONDS = None
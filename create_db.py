@@ -1,7 +1,89 @@
+from itertools import groupby
 from pymysql.connections import Connection
+from sqlalchemy import inspect, text, select, update, delete, bindparam, or_, union, String
+from sqlalchemy.schema import CreateColumn
 from app import create_app, db
+from stats import TaskStats
+from changes import take_change_seqs, advance_change_seqs, CHANGE_SEQ, PRUNED_SEQ
+from models import Tasks, ArchivedTasks, TaskTombstones, Sequences
+from sharding import task_engines
 from configmodule import DevelopmentConfig
-from config import DB_NAME, DB_HOST, DB_PORT, DB_LOGIN, DB_PASS
+from config import DB_NAME, DB_HOST, DB_PORT, DB_LOGIN, DB_PASS, LOGIN
+
+
+def add_missing_columns():
+    """Add columns introduced after the tables were created, db.create_all only creates missing tables"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+
+
+def widen_columns():
+    """Lengthen the string columns made longer after the tables were created"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            length = getattr(existing.get(column.name), 'length', None)
+            if isinstance(column.type, String) and column.type.length and length and length < column.type.length:
+                column_ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+                db.session.execute(text(f"ALTER TABLE {table.name} MODIFY COLUMN {column_ddl}"))
+
+
+# indexes replaced by the ones starting with the owner, nothing reads them and they only slow the writes down;
+# other indexes the models do not declare, such as ones added by hand, are left alone
+SUPERSEDED_INDEXES = {
+    'tasks': ('ix_tasks_completed_id', 'ix_tasks_created_at_id', 'ix_tasks_updated_at_id',
+              'ix_tasks_completed_created_at_id', 'ix_tasks_change_seq'),
+    'archived_tasks': ('ix_archived_tasks_created_at_id', 'ix_archived_tasks_updated_at_id',
+                       'ix_archived_tasks_change_seq'),
+}
+
+
+def add_missing_indexes():
+    """Create indexes introduced after the tables were created, then drop the SUPERSEDED_INDEXES"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+        for name in existing.intersection(SUPERSEDED_INDEXES.get(table.name, ())):
+            db.session.execute(text(f"DROP INDEX {name} ON {table.name}"))
+
+
+def split_change_seqs():
+    """Start the change counter and pruned number of every owner from the ones the owners shared before"""
+    shared = dict(db.session.execute(select(Sequences.name, Sequences.next_value)
+                                     .where(Sequences.name.in_([CHANGE_SEQ, PRUNED_SEQ]))).all())
+    if shared:
+        owners = db.session.scalars(union(*[select(model.owner) for model in (Tasks, ArchivedTasks, TaskTombstones)]))
+        for owner in owners.all():
+            advance_change_seqs(db.session.connection(), owner, shared.get(CHANGE_SEQ), shared.get(PRUNED_SEQ))
+        db.session.execute(delete(Sequences).where(Sequences.name.in_(shared)))
+
+
+def backfill_change_seq():
+    """Number the tasks written before the change feed existed, so that GET /todo/changes?since=0 returns them"""
+    rows = db.session.execute(select(Tasks.owner, Tasks.id).where(Tasks.change_seq.is_(None))
+                              .order_by(Tasks.owner, Tasks.id)).all()
+    for owner, owned in groupby(rows, key=lambda row: row.owner):
+        ids = [row.id for row in owned]
+        change_seqs = take_change_seqs(db.session.connection(), owner, len(ids))
+        db.session.execute(update(Tasks.__table__).where(Tasks.id == bindparam('task_id'))
+                           .values(change_seq=bindparam('seq')),
+                           [{'task_id': task_id, 'seq': seq} for task_id, seq in zip(ids, change_seqs)])
+
+
+def backfill_owner():
+    """Give the tasks written before tasks had owners to the LOGIN user, the only user there was"""
+    for model in (Tasks, ArchivedTasks, TaskTombstones):
+        db.session.execute(update(model).where(or_(model.owner.is_(None), model.owner == '')).values(owner=LOGIN))
+
 
 app = create_app(DevelopmentConfig)
 try:
@@ -14,6 +96,18 @@ try:
         cur.execute("SHOW DATABASES")
         cur.close()
         db.create_all()
+        add_missing_columns()
+        widen_columns()
+        db.session.commit()
+        add_missing_indexes()
+        db.session.commit()
+        backfill_owner()
+        split_change_seqs()
+        backfill_change_seq()
         db.session.commit()
+        for engine in task_engines(app):
+            # the shard databases hold the tables of the models without a bind key
+            db.metadata.create_all(engine)
+            TaskStats.from_config(app.config).reconcile(engine)
 except BaseException as e:
     print(e)
@@ -0,0 +1,87 @@
+"""Verification of API credentials: passwords (plain or hashed) and signed bearer tokens
+
+Basic auth sends the password with every request, so a password hash (scrypt, pbkdf2) would cost tens of
+milliseconds per call. Successful verifications are kept in a bounded cache with a time to live, keyed by a keyed
+BLAKE2 digest of the credentials, which brings repeated checks down to microseconds. Failed attempts are never
+cached, so guessing passwords still pays the full hashing cost.
+"""
+import hashlib
+import secrets
+from hmac import compare_digest
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from werkzeug.security import check_password_hash
+from cache import LRUCache
+
+HASH_METHODS = ('scrypt', 'pbkdf2')
+
+
+def is_password_hash(value):
+    """True for hashes made by werkzeug.security.generate_password_hash, e.g. 'scrypt:32768:8:1$salt$hash'"""
+    method, separator, _ = value.partition('$')
+    return bool(separator) and method.split(':')[0] in HASH_METHODS
+
+
+class Authenticator(object):
+    """Checks passwords of `users` (username -> password hash or plain password) and issues tokens
+
+    `secret_key` signs the tokens, without one a random key is used and tokens are valid in this process only.
+    """
+
+    def __init__(self, users, secret_key=None, token_ttl=3600, cache_size=1000, cache_ttl=300):
+        self.users = dict(users)
+        self.token_ttl = token_ttl
+        self._digest_key = secrets.token_bytes(32)
+        self._verified = LRUCache(max_size=cache_size, ttl=cache_ttl)
+        self._tokens = URLSafeTimedSerializer(secret_key or secrets.token_hex(32), salt='auth-token')
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['AUTH_USERS'], secret_key=config.get('SECRET_KEY'), token_ttl=config['AUTH_TOKEN_TTL'],
+                   cache_size=config['AUTH_CACHE_SIZE'], cache_ttl=config['AUTH_CACHE_TTL'])
+
+    def verify_password(self, username, password):
+        """Return the username when the password is right, else None"""
+        return self.verified(username, password) or self.check_password(username, password)
+
+    def verified(self, username, password):
+        """Return the username when the password has been verified recently, without hashing it"""
+        key = self._cache_key(username, password)
+        return username if key is not None and self._verified.get(key) else None
+
+    def check_password(self, username, password):
+        """Verify the password against the stored hash and remember a success"""
+        key = self._cache_key(username, password)
+        if key is None:
+            return None
+        stored = self.users[username]
+        if is_password_hash(stored):
+            valid = check_password_hash(stored, password)
+        else:
+            valid = compare_digest(stored.encode(), password.encode())
+        if not valid:
+            return None
+        self._verified.set(key, True)
+        return username
+
+    def _cache_key(self, username, password):
+        stored = self.users.get(username)
+        if stored is None or password is None:
+            return None
+        # the stored value is part of the key, so a changed password drops the old entries
+        return hashlib.blake2b('\0'.join((username, password, stored)).encode(), key=self._digest_key,
+                               digest_size=16).digest()
+
+    def issue_token(self, username):
+        return self._tokens.dumps({'user': username})
+
+    def verify_token(self, token):
+        """Return the username of a valid, unexpired token of a known user, else None"""
+        try:
+            data = self._tokens.loads(token, max_age=self.token_ttl)
+        except BadSignature:
+            return None
+        username = data.get('user') if isinstance(data, dict) else None
+        return username if username in self.users else None
+
+    def stats(self):
+        return self._verified.stats()
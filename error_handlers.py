@@ -1,55 +1,71 @@
-from flask import jsonify, make_response
+import time
+from flask import jsonify, make_response, g, request, has_request_context
 import logging
 from sqlalchemy.exc import SQLAlchemyError, ProgrammingError, IntegrityError, \
     DatabaseError, DataError, InternalError, NotSupportedError, InterfaceError, OperationalError
 
-logging.basicConfig(level=logging.ERROR)
 logger_db_error = logging.getLogger(__name__)
 
 
+def request_fields():
+    """Fields of the request being handled for the log record of its error"""
+    if not has_request_context():
+        return {}
+    fields = {'endpoint': request.endpoint, 'method': request.method,
+              'task_id': (request.view_args or {}).get('id')}
+    if 'metrics_start' in g:
+        fields['duration_ms'] = round((time.perf_counter() - g.metrics_start) * 1000, 1)
+    return fields
+
+
+def log_db_error(error, **fields):
+    """Log a database error as a structured record: the driver message, its SQLAlchemy class and `fields`"""
+    logger_db_error.error(f"{getattr(error, 'orig', None) or error}",
+                          extra=dict(fields or request_fields(), sql_error=type(error).__name__))
+
+
 def handler_sqlalchemy_error(error: SQLAlchemyError):
-    e = str(error.__dict__["orig"])
-    logger_db_error.error(f"{e}")
+    log_db_error(error)
     return make_response(jsonify({'message': f'Database error'}), 500)
 
 
 def handler_programming_error(error: ProgrammingError):
-    logger_db_error.error(f"{error.orig}")
+    log_db_error(error)
     return make_response(jsonify({'message': f'Database error'}), 500)
 
 
 def handler_integrity_error(error: IntegrityError):
-    logger_db_error.error(f"{error.orig}")
+    log_db_error(error)
     return make_response(jsonify({'message': f'Database error'}), 500)
 
 
 def handler_database_error(error: DatabaseError):
-    logger_db_error.error(f"{error.orig}")
+    log_db_error(error)
     return make_response(jsonify({'message': f'Database error'}), 500)
 
 
 def handler_data_error(error: DataError):
-    logger_db_error.error(f"{error.orig}")
+    log_db_error(error)
     return make_response(jsonify({'message': f'Database error: {error.orig}'}), 500)
 
 
 def handler_internal_error(error: InternalError):
-    logger_db_error.error(f"{error.orig}")
+    log_db_error(error)
     return make_response(jsonify({'message': f'Database error'}), 500)
 
 
 def handler_not_supported_error(error: NotSupportedError):
-    logger_db_error.error(f"{error.orig}")
+    log_db_error(error)
     return make_response(jsonify({'message': f'Database error'}), 500)
 
 
 def handler_interface_error(error: InterfaceError):
-    logger_db_error.error(f"{error.orig}")
+    log_db_error(error)
     return make_response(jsonify({'message': f'Database error'}), 500)
 
 
 def handler_operational_error(error: OperationalError):
-    logger_db_error.error(f"{error.orig}")
+    log_db_error(error)
     return make_response(jsonify({'message': f'Database error'}), 500)
 
 
@@ -0,0 +1,90 @@
+import os
+import queue
+import time
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+
+class GroupCommitWriter(object):
+    """Coalesces writes of concurrent requests into one transaction and one commit
+
+    Requests `submit` an item and wait on the returned future. A background thread collects the items arriving
+    within `max_delay` seconds of the first one, up to `max_batch`, and passes them to `write(items)` inside an
+    app context; `write` must insert them and commit. While a batch commits the next one fills up, so under load
+    the commit latency is shared by the whole batch. When a batch fails, its items are written one at a time so
+    that each request gets its own result or error. Any other failure fails the futures of its batch and the thread
+    goes on with the next one. Items whose future was cancelled before their batch was taken are not written.
+
+    With `partition(item)`, a batch is split into one `write` per partition, such as per database shard.
+    """
+
+    def __init__(self, app, write, max_delay=0.002, max_batch=100, partition=None):
+        self.app = app
+        self.write = write
+        self.partition = partition
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._lock = Lock()
+        self._queue = None
+        self._pid = None
+
+    @classmethod
+    def from_config(cls, app, write, partition=None):
+        return cls(app, write, max_delay=app.config['TASKS_GROUP_COMMIT_MAX_DELAY'],
+                   max_batch=app.config['TASKS_GROUP_COMMIT_MAX_BATCH'], partition=partition)
+
+    def submit(self, item):
+        """Queue an item for the next batch, the future resolves to the item once it is committed"""
+        future = Future()
+        self._items().put((item, future))
+        return future
+
+    def _items(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # threads do not survive a fork, every process starts its own writer
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                Thread(target=self._run, args=(self._queue,), name='group-commit-writer', daemon=True).start()
+            return self._queue
+
+    def _run(self, items):
+        while True:
+            batch = [items.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(items.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            try:
+                self._write_partitions(batch)
+            except BaseException as e:
+                for item, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _write_partitions(self, batch):
+        if self.partition is None:
+            partitions = {None: batch} if batch else {}
+        else:
+            partitions = {}
+            for entry in batch:
+                partitions.setdefault(self.partition(entry[0]), []).append(entry)
+        for entries in partitions.values():
+            self._write(entries)
+
+    def _write(self, batch):
+        try:
+            with self.app.app_context():
+                self.write([item for item, future in batch])
+        except BaseException as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            for entry in batch:
+                self._write([entry])
+            return
+        for item, future in batch:
+            future.set_result(item)
@@ -0,0 +1,119 @@
+import asyncio
+import os
+from threading import Lock
+from sqlalchemy import select, update, insert
+from sqlalchemy.exc import IntegrityError
+from models import db, Sequences
+
+
+def _advance(name, step):
+    return update(Sequences).where(Sequences.name == name).values(next_value=Sequences.next_value + step)
+
+
+def _current(name):
+    return select(Sequences.next_value).where(Sequences.name == name)
+
+
+def advance_sequence(name, step, initial=None, engine=None):
+    """Add `step` to a row of the sequences table in its own short transaction and return the new value
+
+    A missing row is first created with the value returned by `initial(connection)`, or 0. The row is in the
+    database of `engine`, by default in the default one.
+    """
+    engine = engine or db.engine
+    while True:
+        with engine.begin() as connection:
+            if connection.execute(_advance(name, step)).rowcount:
+                return connection.scalar(_current(name))
+        try:
+            with engine.begin() as connection:
+                start = initial(connection) if initial else 0
+                connection.execute(insert(Sequences).values(name=name, next_value=start))
+        except IntegrityError:
+            # another process created it first
+            pass
+
+
+async def advance_sequence_async(engine, name, step, initial=None):
+    """advance_sequence on an asyncio engine, `initial` is awaited with the connection"""
+    while True:
+        async with engine.begin() as connection:
+            if (await connection.execute(_advance(name, step))).rowcount:
+                return await connection.scalar(_current(name))
+        try:
+            async with engine.begin() as connection:
+                start = await initial(connection) if initial else 0
+                await connection.execute(insert(Sequences).values(name=name, next_value=start))
+        except IntegrityError:
+            pass
+
+
+class IdAllocator(object):
+    """Block based (hi/lo) id allocator
+
+    Every process reserves a block of `block_size` ids with one short UPDATE of its row in the
+    sequences table and hands ids out of that block from memory. Concurrent writers never compute
+    the same id and never wait on each other for more than that UPDATE. All inserts into the table
+    must take their ids from the allocator.
+    """
+
+    def __init__(self, model, block_size):
+        self.model = model
+        self.name = model.__tablename__
+        self.block_size = block_size
+        self._lock = Lock()
+        self._next = self._end = 0
+        self._pid = None
+
+    def allocate(self, count=1):
+        """Return a list of `count` unused ids"""
+        with self._lock:
+            ids = self._take(count)
+            while len(ids) < count:
+                self._next, self._end = self._reserve(max(self.block_size, count - len(ids)))
+                ids += self._take(count - len(ids))
+        return ids
+
+    def _take(self, count):
+        """Hand out up to `count` ids left in the current block"""
+        if self._pid != os.getpid():
+            # a block inherited from the parent process is shared with its other children
+            self._next = self._end = 0
+            self._pid = os.getpid()
+        taken = min(count, self._end - self._next)
+        ids = list(range(self._next, self._next + taken))
+        self._next += taken
+        return ids
+
+    def _reserve(self, size):
+        """Move the stored high value by `size` and return the reserved range [start, end)"""
+        end = advance_sequence(self.name, size, initial=self._first_free_id)
+        return end - size, end
+
+    def _first_free_id(self, connection):
+        # start after the ids already in the table
+        return (connection.scalar(select(db.func.max(self.model.id))) or 0) + 1
+
+
+class AsyncIdAllocator(IdAllocator):
+    """IdAllocator for the asyncio engine of asgi_app.py, sharing the sequences table with it"""
+
+    def __init__(self, model, block_size, engine):
+        super(AsyncIdAllocator, self).__init__(model, block_size)
+        self.engine = engine
+        self._lock = asyncio.Lock()
+
+    async def allocate(self, count=1):
+        async with self._lock:
+            ids = self._take(count)
+            while len(ids) < count:
+                self._next, self._end = await self._reserve(max(self.block_size, count - len(ids)))
+                ids += self._take(count - len(ids))
+        return ids
+
+    async def _reserve(self, size):
+        end = await advance_sequence_async(self.engine, self.name, size, initial=self._first_free_id)
+        return end - size, end
+
+    async def _first_free_id(self, connection):
+        return (await connection.scalar(select(db.func.max(self.model.id))) or 0) + 1
@@ -0,0 +1,114 @@
+"""Streaming import of tasks from CSV or NDJSON, POST /todo/import
+
+The body is read through a buffer one record at a time, so memory does not grow with the size of the upload.
+Valid records are collected into chunks that are written, and committed, one chunk at a time; a chunk the database
+refuses is retried row by row, so that one bad row only rejects itself. The report counts accepted and rejected
+records and lists the first rejections with their line numbers.
+"""
+import csv
+import io
+import json
+from operator import itemgetter
+from sqlalchemy.exc import DataError, IntegrityError
+from validation import ValidationError
+
+FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson'}
+# longest NDJSON line read, longer lines are rejected without being kept in memory
+MAX_LINE_LENGTH = 1024 * 1024
+
+
+def buffered(stream):
+    """Wrap a raw stream, such as werkzeug's LimitedStream, so that lines are not read byte by byte"""
+    return io.BufferedReader(stream, 64 * 1024) if isinstance(stream, io.RawIOBase) else stream
+
+
+def ndjson_records(stream, max_line_length=MAX_LINE_LENGTH):
+    """Yield (line number, record, error message) for every non-empty line of an NDJSON stream"""
+    number = 0
+    while True:
+        line = stream.readline(max_line_length + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > max_line_length and not line.endswith(b'\n'):
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_line_length)
+            yield number, None, f'Line is longer than {max_line_length} bytes'
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError:
+            yield number, None, 'Invalid JSON'
+
+
+def csv_records(stream):
+    """Yield (line number, record, error message) for every row of a UTF-8 CSV stream with a header row
+
+    Empty cells count as missing, so the defaults of the schema apply. The line number is the last line of the
+    row, rows may span lines in quoted cells. An undecodable or malformed stream ends the import at that line.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+    try:
+        for row in reader:
+            yield reader.line_num, {name: value for name, value in row.items()
+                                    if name is not None and value not in (None, '')}, None
+    except (csv.Error, UnicodeDecodeError) as e:
+        yield reader.line_num + 1, None, f'Invalid CSV, import stopped: {e}'
+
+
+class ImportReport(object):
+    def __init__(self, max_errors=1000):
+        self.max_errors = max_errors
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line, message):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'message': message})
+
+    def to_dict(self):
+        # records refused by the database are reported when their chunk is written, after later invalid ones
+        return {'accepted': self.accepted, 'rejected': self.rejected,
+                'errors': sorted(self.errors, key=itemgetter('line')),
+                'errors_truncated': self.rejected > len(self.errors)}
+
+
+def import_records(records, schema, write, chunk_size=1000, max_errors=1000):
+    """Validate records against `schema` and write the valid ones in chunks, return the ImportReport
+
+    `records` are (line number, record, error message) tuples, `write(values)` must insert and commit a chunk of
+    up to `chunk_size` validated records.
+    """
+    report = ImportReport(max_errors)
+    chunk = []
+    for line, record, error in records:
+        if error is None:
+            try:
+                chunk.append((line, schema.parse(record)))
+            except ValidationError as e:
+                error = e.message
+        if error is not None:
+            report.reject(line, error)
+        if len(chunk) >= chunk_size:
+            _write_chunk(chunk, write, report)
+            chunk = []
+    if chunk:
+        _write_chunk(chunk, write, report)
+    return report
+
+
+def _write_chunk(chunk, write, report):
+    try:
+        write([values for line, values in chunk])
+    except (DataError, IntegrityError) as e:
+        if len(chunk) == 1:
+            report.reject(chunk[0][0], f'Database error: {e.orig}')
+            return
+        for entry in chunk:
+            _write_chunk([entry], write, report)
+        return
+    report.accepted += len(chunk)
@@ -0,0 +1,76 @@
+import logging
+import os
+import threading
+import time
+from sqlalchemy.exc import SQLAlchemyError
+
+logger_jobs = logging.getLogger(__name__)
+
+
+def start_periodic_job(name, interval, job):
+    """Run `job()` now and then every `interval` seconds in a daemon thread of this process
+
+    Database errors are logged and the job runs again at the next interval.
+    """
+    def run():
+        while True:
+            try:
+                job()
+            except SQLAlchemyError as e:
+                logger_jobs.error(f'{name} failed: {e}')
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+class ProcessJobs(object):
+    """Periodic jobs of an app, started in every process that serves its requests, or once per server
+
+    Threads do not survive a fork. A prefork server creates the app in its master process and forks the workers,
+    so the jobs start with the first request of each process instead of in create_app. Jobs added with `add_once`
+    run in one process per server: the development server that created the app, or the jobs process of server.py,
+    which calls `start_once`.
+    """
+
+    def __init__(self):
+        self.starters = []
+        self.once_starters = []
+        self._lock = threading.Lock()
+        self._pid = None
+        self._creator_pid = os.getpid()
+        self._started_once = False
+
+    def init_app(self, app):
+        app.extensions['jobs'] = self
+        app.before_request(self.start)
+        return self
+
+    def add(self, start_job, *args):
+        """Call `start_job(*args)`, such as changes.start_pruner, once in every process"""
+        self.starters.append((start_job, args))
+
+    def add_once(self, start_job, *args):
+        """Call `start_job(*args)`, such as stats.start_reconciler, in one process per server"""
+        self.once_starters.append((start_job, args))
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                for start_job, args in self.starters:
+                    start_job(*args)
+        # workers forked from the process that created the app leave them to it
+        if os.getpid() == self._creator_pid:
+            self.start_once()
+
+    def start_once(self):
+        with self._lock:
+            if self._started_once:
+                return
+            self._started_once = True
+            for start_job, args in self.once_starters:
+                start_job(*args)
@@ -0,0 +1,151 @@
+"""Non-blocking logging in JSON lines
+
+Request threads only put records on a bounded queue; a QueueListener thread formats them as JSON and writes them.
+When the queue is full a record is dropped and counted instead of waited for, the next record that gets through
+carries the count. Identical messages are logged once per `dedup_seconds`, the next one after that carries the
+number suppressed in between, so an error storm costs a dict lookup per failing request instead of a write.
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+
+# attributes every LogRecord has, the others are the `extra` fields of the call
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+# the QueueLogging of this process
+_installed = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and the `extra` fields"""
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+                 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class Deduplicate(logging.Filter):
+    """Pass a message once per `interval` seconds, a passing repeat gets `repeated`, the number suppressed
+
+    The last `max_messages` distinct messages are remembered, an evicted one passes again.
+    """
+
+    def __init__(self, interval, max_messages=1000):
+        super(Deduplicate, self).__init__()
+        self.interval = interval
+        self.max_messages = max_messages
+        self._seen = OrderedDict()
+        self._lock = Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is not None:
+                if now - seen[0] < self.interval:
+                    seen[1] += 1
+                    return False
+                if seen[1]:
+                    record.repeated = seen[1]
+                self._seen.move_to_end(key)
+            self._seen[key] = [now, 0]
+            while len(self._seen) > self.max_messages:
+                self._seen.popitem(last=False)
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: records that do not fit in the queue are counted in `dropped`"""
+
+    def __init__(self, log_queue):
+        super(DroppingQueueHandler, self).__init__(log_queue)
+        self.setFormatter(logging.Formatter())
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the listener gets a picklable copy with the message and traceback formatted, and the `extra` fields
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        if record.exc_info:
+            record.exception = self.formatter.formatException(record.exc_info)
+        record.args = record.exc_info = record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        # emit runs under the lock of the handler
+        if self.dropped:
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped = 0
+
+
+class QueueLogging(object):
+    """Logging of the process through a queue to JSON lines on `stream` (stderr), installed on the root logger
+
+    The first app of the process installs it, the logging of later apps is the one installed.
+    """
+
+    def __init__(self, level='ERROR', queue_size=10000, dedup_seconds=60, stream=None):
+        self.level = level
+        self.queue_size = queue_size
+        self.handler = DroppingQueueHandler(queue.Queue(queue_size))
+        if dedup_seconds:
+            self.handler.addFilter(Deduplicate(dedup_seconds))
+        self.output = logging.StreamHandler(stream or sys.stderr)
+        self.output.setFormatter(JSONFormatter())
+        self.listener = QueueListener(self.handler.queue, self.output)
+        self.running = False
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(level=config['LOG_LEVEL'], queue_size=config['LOG_QUEUE_SIZE'],
+                   dedup_seconds=config['LOG_DEDUP_SECONDS'])
+
+    def init_app(self, app):
+        app.extensions['logging'] = self.install()
+
+    def install(self):
+        global _installed
+        if _installed is not None:
+            return _installed
+        _installed = self
+        root = logging.getLogger()
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        self.running = True
+        # the listener thread stays in the parent of a fork, a child starts its own on a new queue
+        os.register_at_fork(after_in_child=self._restart)
+        # write what is still queued at exit
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """Write the queued records and stop the listener thread"""
+        if self.running:
+            self.running = False
+            self.listener.stop()
+
+    def _restart(self):
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.handler.dropped = 0
+        self.listener = QueueListener(self.handler.queue, self.output)
+        if self.running:
+            self.listener.start()
@@ -0,0 +1,266 @@
+"""Request latency and SQL instrumentation, exposed in the Prometheus text format
+
+Metrics live in the memory of the process, so with several worker processes every worker reports its own.
+"""
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+logger_slow_request = logging.getLogger(__name__)
+logger_slow_request.setLevel(logging.WARNING)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# statements kept for the slow request log, so that long requests (an import) do not collect them all
+MAX_LOGGED_STATEMENTS = 100
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = defaultdict(float)
+        self._lock = Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {format_value(value)}'
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # per label values: [count of every bucket (not cumulative), sum]
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, labels, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * len(self.buckets) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                yield f'{self.name}_bucket{format_labels(self.labels, labels, le)} {format_value(cumulative)}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {format_value(counts[-1])}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {format_value(cumulative)}'
+
+
+class Gauge(object):
+    """Gauge read at scrape time: `collect` returns a dict of label values to the current value"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, collect, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in sorted(self.collect().items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {format_value(value)}'
+
+
+class PoolWait(object):
+    """Wait for connections of one pool as it is now, for admission control
+
+    `current` returns the number of checkouts waiting and the longer of the oldest wait in progress and a moving
+    average of the finished waits, which halves every `half_life` seconds without new checkouts.
+    """
+
+    def __init__(self, half_life=5.0):
+        self.half_life = half_life
+        self._waiting = {}
+        self._average = 0.0
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def start(self):
+        token = object()
+        with self._lock:
+            self._waiting[token] = time.monotonic()
+        return token
+
+    def finish(self, token, elapsed):
+        with self._lock:
+            del self._waiting[token]
+            now = time.monotonic()
+            self._average = 0.8 * self._decayed(now) + 0.2 * elapsed
+            self._updated = now
+
+    def current(self):
+        with self._lock:
+            now = time.monotonic()
+            longest = now - min(self._waiting.values()) if self._waiting else 0.0
+            return len(self._waiting), max(longest, self._decayed(now))
+
+    def _decayed(self, now):
+        return self._average * 0.5 ** ((now - self._updated) / self.half_life)
+
+
+class Metrics(object):
+    """Records latency and status of every request, the SQL statements it ran and the wait for pool connections
+
+    `slow_request_seconds` logs every request slower than that, together with the SQL it executed.
+    """
+
+    def __init__(self, slow_request_seconds=None):
+        self.slow_request_seconds = slow_request_seconds
+        self.engines = {}
+        self.pool_waits = {}
+        self.request_duration = Histogram('todo_http_request_duration_seconds', 'Latency of HTTP requests',
+                                          LATENCY_BUCKETS, ('endpoint', 'method'))
+        self.requests = Counter('todo_http_requests_total', 'HTTP responses by status code',
+                                ('endpoint', 'method', 'status'))
+        self.request_statements = Histogram('todo_http_request_sql_statements', 'SQL statements run per HTTP request',
+                                            STATEMENT_BUCKETS, ('endpoint',))
+        self.request_sql_duration = Histogram('todo_http_request_sql_duration_seconds',
+                                              'Time spent in SQL per HTTP request', LATENCY_BUCKETS, ('endpoint',))
+        self.statement_duration = Histogram('todo_sql_statement_duration_seconds', 'Latency of SQL statements',
+                                            SQL_BUCKETS, ('bind',))
+        self.pool_checkout = Histogram('todo_db_pool_checkout_seconds', 'Wait for a connection from the pool',
+                                       SQL_BUCKETS, ('bind',))
+        self.pool_checked_out = Gauge('todo_db_pool_checked_out', 'Connections currently checked out of the pool',
+                                      self._checked_out, ('bind',))
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(slow_request_seconds=config.get('TASKS_SLOW_REQUEST_SECONDS'))
+
+    def init_app(self, app, engines):
+        """Hook into the requests of `app` and the `engines` (a dict of bind name to engine)"""
+        app.extensions['task_metrics'] = self
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        for bind, engine in engines.items():
+            self.instrument_engine(engine, bind or 'default')
+
+    def instrument_engine(self, engine, bind):
+        self.engines[bind] = engine
+        self.pool_waits[bind] = PoolWait()
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info['metrics_start'].pop()
+            self.statement_duration.observe((bind,), elapsed)
+            if has_request_context() and 'metrics_start' in g:
+                g.metrics_sql_count += 1
+                g.metrics_sql_duration += elapsed
+                if self.slow_request_seconds is not None and len(g.metrics_sql) < MAX_LOGGED_STATEMENTS:
+                    g.metrics_sql.append((elapsed, statement))
+
+        @event.listens_for(engine, 'engine_disposed')
+        def engine_disposed(engine):
+            # dispose() replaces the pool
+            self._time_checkouts(engine.pool, bind)
+
+        self._time_checkouts(engine.pool, bind)
+
+    def _time_checkouts(self, pool, bind):
+        # the pool has no event before a checkout starts to wait, so time the call itself
+        connect = pool.connect
+
+        def timed_connect():
+            start = time.perf_counter()
+            token = self.pool_waits[bind].start()
+            try:
+                return connect()
+            finally:
+                elapsed = time.perf_counter() - start
+                self.pool_waits[bind].finish(token, elapsed)
+                self.pool_checkout.observe((bind,), elapsed)
+
+        pool.connect = timed_connect
+
+    def pool_pressure(self):
+        """Checkouts waiting for a connection in all pools, and the longest current wait of any pool in seconds"""
+        waits = [pool_wait.current() for pool_wait in self.pool_waits.values()]
+        return sum(waiting for waiting, wait in waits), max((wait for waiting, wait in waits), default=0.0)
+
+    def _checked_out(self):
+        return {(bind,): engine.pool.checkedout() for bind, engine in self.engines.items()
+                if hasattr(engine.pool, 'checkedout')}
+
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_duration = 0.0
+        g.metrics_sql = []
+
+    def _finish_request(self, response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        endpoint = request.endpoint or 'unmatched'
+        self.request_duration.observe((endpoint, request.method), elapsed)
+        self.requests.inc((endpoint, request.method, str(response.status_code)))
+        self.request_statements.observe((endpoint,), g.metrics_sql_count)
+        self.request_sql_duration.observe((endpoint,), g.metrics_sql_duration)
+        if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds:
+            statements = ''.join(f'\n  {duration * 1000:.1f} ms: {statement}'
+                                 for duration, statement in g.metrics_sql)
+            logger_slow_request.warning(f'Slow request {request.method} {request.full_path.rstrip("?")} '
+                                        f'{response.status_code} {elapsed * 1000:.1f} ms, '
+                                        f'{g.metrics_sql_count} SQL statements {g.metrics_sql_duration * 1000:.1f} ms'
+                                        f'{statements}')
+        return response
+
+    def render(self):
+        lines = []
+        for metric in (self.request_duration, self.requests, self.request_statements, self.request_sql_duration,
+                       self.statement_duration, self.pool_checkout, self.pool_checked_out):
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
@@ -1,16 +1,85 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from flask_restful import fields
-db = SQLAlchemy()
+from serializers import columns_for, compile_serializer
+from routing import RoutingSession
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Tasks(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    # username of the user the task belongs to, every request reads and writes the tasks of its user only
+    owner = db.Column(db.String(80), nullable=False)
     title = db.Column(db.String(100))
     description = db.Column(db.Text)
     completed = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime)
+    # incremented by the ORM on every UPDATE, which is also checked in its WHERE clause
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # position in the change feed, taken from a counter by every write, see changes.py
+    change_seq = db.Column(db.BigInteger)
+
+    __mapper_args__ = {'version_id_col': version}
+    # composite indexes behind the filters and sort orders of GET /todo of one owner, the id makes keyset seeks exact
+    __table_args__ = (
+        db.Index('ix_tasks_owner_id', 'owner', 'id'),
+        db.Index('ix_tasks_owner_completed_id', 'owner', 'completed', 'id'),
+        db.Index('ix_tasks_owner_created_at_id', 'owner', 'created_at', 'id'),
+        db.Index('ix_tasks_owner_updated_at_id', 'owner', 'updated_at', 'id'),
+        db.Index('ix_tasks_owner_completed_created_at_id', 'owner', 'completed', 'created_at', 'id'),
+        db.Index('ix_tasks_owner_completed_updated_at_id', 'owner', 'completed', 'updated_at', 'id'),
+        db.Index('ix_tasks_owner_change_seq', 'owner', 'change_seq'),
+        # archive.py, which selects the completed tasks of all owners by their last change
+        db.Index('ix_tasks_completed_updated_at_id', 'completed', 'updated_at', 'id'),
+        # GET /todo/search on MySQL, other databases use search.InvertedIndex
+        db.Index('ix_tasks_title_description_fulltext', 'title', 'description',
+                 mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
+
+
+class ArchivedTasks(db.Model):
+    """Completed tasks moved out of the tasks table by archive.py, with their ids, versions and change numbers"""
+    __tablename__ = 'archived_tasks'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    owner = db.Column(db.String(80), nullable=False)
+    title = db.Column(db.String(100))
+    description = db.Column(db.Text)
+    completed = db.Column(db.Boolean)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False)
+    change_seq = db.Column(db.BigInteger)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+    # the sort orders of GET /todo?include_archived=true, every archived task is completed
+    __table_args__ = (
+        db.Index('ix_archived_tasks_owner_id', 'owner', 'id'),
+        db.Index('ix_archived_tasks_owner_created_at_id', 'owner', 'created_at', 'id'),
+        db.Index('ix_archived_tasks_owner_updated_at_id', 'owner', 'updated_at', 'id'),
+        db.Index('ix_archived_tasks_owner_change_seq', 'owner', 'change_seq'),
+    )
+
+
+class Sequences(db.Model):
+    """Named counters: next free id per table (id_allocator.IdAllocator), the version of the tasks collection
+    (versioning.py), the task statistics (stats.TaskStats) and the change feed sequences (changes.py)"""
+    # long enough for the names of the counters of an owner
+    name = db.Column(db.String(120), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False)
+
+
+class TaskTombstones(db.Model):
+    """Deleted tasks, reported by GET /todo/changes until they are pruned"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    owner = db.Column(db.String(80), nullable=False)
+    # the index on change_seq alone serves the pruning, the one with the owner GET /todo/changes
+    change_seq = db.Column(db.BigInteger, nullable=False, index=True)
+    deleted_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_task_tombstones_owner_change_seq', 'owner', 'change_seq'),
+    )
 
 
 task_fields = {
@@ -21,3 +90,9 @@ task_fields = {
     'created_at': fields.DateTime,
     'updated_at': fields.DateTime,
 }
+
+# read endpoints select these plain columns and serialize the rows without building ORM objects,
+# the output is the same as marshal(task, task_fields)
+task_columns = columns_for(Tasks.__table__, task_fields)
+archived_task_columns = columns_for(ArchivedTasks.__table__, task_fields)
+serialize_task = compile_serializer(task_fields)
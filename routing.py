@@ -0,0 +1,46 @@
+import random
+from flask import current_app, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+def replica_bind_keys(app):
+    """Add SQLALCHEMY_REPLICA_URIS to SQLALCHEMY_BINDS and return their bind keys, call before db.init_app
+
+    Flask-SQLAlchemy applies SQLALCHEMY_ENGINE_OPTIONS to the default engine only, so the pool
+    settings are copied into every replica bind.
+    """
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    keys = []
+    for i, uri in enumerate(app.config.get('SQLALCHEMY_REPLICA_URIS') or []):
+        keys.append(f'replica_{i}')
+        binds[keys[-1]] = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}, url=uri)
+    app.config['SQLALCHEMY_BINDS'] = binds
+    return keys
+
+
+class RoutingSession(Session):
+    """Session sending the reads of GET and HEAD requests to a read replica, everything else to the primary
+
+    A request sticks to one randomly chosen replica. Replicas lag behind the primary,
+    so a client may not see its own write in a GET that immediately follows it.
+
+    With shards (sharding.py) everything goes to the shard of the owner instead, replicas are not used.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shards = current_app.extensions.get('task_shards') if has_app_context() else None
+        if bind is None and shards is not None:
+            key = shards.session_bind_key(self)
+            if key is not None:
+                return self._db.engines[key]
+        elif bind is None and not self._flushing and not isinstance(clause, UpdateBase) \
+                and has_request_context() and request.method in READ_METHODS:
+            replicas = current_app.extensions.get('replica_binds')
+            if replicas:
+                if 'replica' not in self.info:
+                    self.info['replica'] = random.choice(replicas)
+                return self._db.engines[self.info['replica']]
+        return super(RoutingSession, self).get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
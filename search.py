@@ -0,0 +1,118 @@
+import math
+import re
+from collections import defaultdict
+from threading import Lock
+from sqlalchemy import select
+from sqlalchemy.dialects.mysql import match
+from models import db, Tasks
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower()) if text else []
+
+
+class SearchBackend(object):
+    """Ranked search over the task titles and descriptions of an owner"""
+
+    def search(self, query, limit, offset, owner):
+        """Return up to `limit` ids of tasks of `owner` matching `query`, best first, skipping `offset` results"""
+        raise NotImplementedError
+
+    def add(self, task_id, title, description, owner):
+        """Index a created or updated task"""
+
+    def remove(self, task_id):
+        """Drop a deleted task from the index"""
+
+
+class FullTextSearch(SearchBackend):
+    """MySQL FULLTEXT index on (title, description), maintained by the database itself"""
+
+    def search(self, query, limit, offset, owner):
+        score = match(Tasks.title, Tasks.description, against=query).in_natural_language_mode()
+        statement = select(Tasks.id).where(Tasks.owner == owner, score > 0).order_by(score.desc(), Tasks.id) \
+            .limit(limit).offset(offset)
+        return list(db.session.scalars(statement))
+
+
+class InvertedIndex(SearchBackend):
+    """In-process inverted index ranked with BM25, the fallback for databases without FULLTEXT
+
+    Every owner has an index of its own, built from the table on its first search and then kept up to
+    date by the writes of this process only, so it suits a single process setup such as local development
+    and tests.
+    """
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        # owner -> (postings, lengths, terms) of its tasks
+        self._indexes = {}
+        self._owners = {}
+        self._lock = Lock()
+
+    def search(self, query, limit, offset, owner):
+        terms = set(tokenize(query))
+        with self._lock:
+            if owner not in self._indexes:
+                self._build(owner)
+            postings_by_term, lengths, _ = self._indexes[owner]
+            if not lengths:
+                return []
+            average_length = sum(lengths.values()) / len(lengths)
+            scores = defaultdict(float)
+            for term in terms:
+                postings = postings_by_term.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (len(lengths) - len(postings) + 0.5) / (len(postings) + 0.5))
+                for task_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * lengths[task_id] / average_length)
+                    scores[task_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [task_id for task_id, _ in ranked[offset:offset + limit]]
+
+    def add(self, task_id, title, description, owner):
+        with self._lock:
+            if owner in self._indexes:
+                self._remove(task_id)
+                self._add(task_id, title, description, owner)
+
+    def remove(self, task_id):
+        with self._lock:
+            self._remove(task_id)
+
+    def _build(self, owner):
+        # runs under the lock, so writes committed while reading are applied after it
+        self._indexes[owner] = (defaultdict(dict), {}, {})
+        statement = select(Tasks.id, Tasks.title, Tasks.description).where(Tasks.owner == owner) \
+            .execution_options(yield_per=1000)
+        for task_id, title, description in db.session.execute(statement):
+            self._add(task_id, title, description, owner)
+
+    def _add(self, task_id, title, description, owner):
+        postings, lengths, terms = self._indexes[owner]
+        tokens = tokenize(title) + tokenize(description)
+        frequencies = defaultdict(int)
+        for token in tokens:
+            frequencies[token] += 1
+        for term, frequency in frequencies.items():
+            postings[term][task_id] = frequency
+        lengths[task_id] = len(tokens)
+        terms[task_id] = tuple(frequencies)
+        self._owners[task_id] = owner
+
+    def _remove(self, task_id):
+        owner = self._owners.pop(task_id, None)
+        if owner is None:
+            return
+        postings_by_term, lengths, terms = self._indexes[owner]
+        lengths.pop(task_id, None)
+        for term in terms.pop(task_id, ()):
+            postings = postings_by_term[term]
+            del postings[task_id]
+            if not postings:
+                del postings_by_term[term]
@@ -0,0 +1,120 @@
+"""Production server: the app is created once in a master process that forks the worker processes (gunicorn)
+
+Every worker serves requests on SERVER_THREADS threads. After the fork a worker replaces the connection pools it
+inherited, so no two processes share a database socket, and its periodic jobs and log listener start in the
+worker itself; the statistics reconciler runs once per server, in a jobs process of its own. Workers are replaced after
+SERVER_MAX_REQUESTS requests or once their memory passes SERVER_MAX_MEMORY; SIGTERM lets them finish their requests
+and close their connections before they exit.
+
+Run it with the settings of ProductionConfig:
+    python3 server.py
+"""
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import time
+from gunicorn.app.base import BaseApplication
+from gunicorn.arbiter import Arbiter
+from app import create_app
+from models import db
+from config import HOST, PORT
+import configmodule
+
+
+def dispose_engines(app, close=True):
+    """Drop the connections of every engine of the app; a forked child leaves those of its parent open"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+
+def peak_memory():
+    """Peak resident memory of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def fork_jobs_process(app):
+    """Fork the process running the jobs of one process per server until the master exits, return its pid
+
+    The master forks the workers all the time, so it runs no threads of the app itself.
+    """
+    master_pid = os.getpid()
+    pid = os.fork()
+    if pid:
+        return pid
+    try:
+        for signum in Arbiter.SIGNALS + [signal.SIGCHLD]:
+            signal.signal(signum, signal.SIG_DFL)
+        dispose_engines(app, close=False)
+        app.extensions['jobs'].start_once()
+        while os.getppid() == master_pid:
+            time.sleep(1)
+    finally:
+        os._exit(0)
+
+
+def server_options(app):
+    """gunicorn settings of the app from its SERVER_* config"""
+    config = app.config
+
+    def post_fork(server, worker):
+        dispose_engines(app, close=False)
+
+    def post_request(worker, req, environ, resp):
+        if config['SERVER_MAX_MEMORY'] is None or not worker.alive:
+            return
+        memory = peak_memory()
+        if memory > config['SERVER_MAX_MEMORY']:
+            # the worker finishes the requests it has and the master starts a new one
+            worker.log.info(f'Worker {worker.pid} used {memory} bytes, restarting')
+            worker.alive = False
+
+    def worker_exit(server, worker):
+        dispose_engines(app)
+
+    jobs_pids = []
+
+    def when_ready(server):
+        if app.extensions['jobs'].once_starters:
+            jobs_pids.append(fork_jobs_process(app))
+
+    def on_exit(server):
+        for pid in jobs_pids:
+            os.kill(pid, signal.SIGTERM)
+
+    return {
+        'bind': f'{HOST}:{PORT}',
+        'workers': config['SERVER_WORKERS'] or multiprocessing.cpu_count(),
+        'worker_class': 'gthread',
+        'threads': config['SERVER_THREADS'],
+        'max_requests': config['SERVER_MAX_REQUESTS'] or 0,
+        'max_requests_jitter': config['SERVER_MAX_REQUESTS_JITTER'] or 0,
+        'graceful_timeout': config['SERVER_GRACEFUL_TIMEOUT'],
+        'preload_app': True,
+        'post_fork': post_fork,
+        'post_request': post_request,
+        'worker_exit': worker_exit,
+        'when_ready': when_ready,
+        'on_exit': on_exit,
+    }
+
+
+class TodoServer(BaseApplication):
+    def __init__(self, app, options=None):
+        self.application = app
+        self.options = server_options(app) if options is None else options
+        super(TodoServer, self).__init__()
+
+    def load_config(self):
+        for name, value in self.options.items():
+            self.cfg.set(name, value)
+
+    def load(self):
+        return self.application
+
+
+if __name__ == '__main__':
+    TodoServer(create_app(configmodule.ProductionConfig)).run()
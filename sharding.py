@@ -0,0 +1,158 @@
+"""Sharding of the tasks by owner across several databases
+
+With SQLALCHEMY_SHARD_URIS set, every owner's tasks, archived tasks, tombstones, change numbers, statistics and
+collection version live in one shard database, chosen by consistent hashing of the owner name. The default
+database keeps the id sequence only, so task ids stay unique across shards and an owner can move between them.
+
+Every shard sits at many points of a hash ring and an owner belongs to the next shard point clockwise from the hash
+of its name. A new shard takes over about 1/N of the owners, the others stay where they are. After changing the
+shards, move the owners that now belong elsewhere (their tasks are missing from their requests until then):
+    python3 sharding.py
+"""
+import hashlib
+from bisect import bisect
+from contextlib import contextmanager
+from flask import has_request_context
+from sqlalchemy import select, insert, delete, union
+from models import db, Tasks, ArchivedTasks, TaskTombstones, Sequences
+from changes import take_change_seqs, advance_change_seqs, change_seq_name, pruned_seq_name
+
+# tables holding the rows of an owner, moved together by move_owner
+OWNER_TABLES = (Tasks.__table__, ArchivedTasks.__table__, TaskTombstones.__table__)
+
+
+def shard_bind_keys(app):
+    """Add SQLALCHEMY_SHARD_URIS (name -> URI) to SQLALCHEMY_BINDS and return their bind keys, call before db.init_app
+
+    The pool settings of SQLALCHEMY_ENGINE_OPTIONS are copied into every shard bind, as for the replicas.
+    """
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    keys = []
+    for name, uri in (app.config.get('SQLALCHEMY_SHARD_URIS') or {}).items():
+        keys.append(f'shard_{name}')
+        binds[keys[-1]] = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}, url=uri)
+    app.config['SQLALCHEMY_BINDS'] = binds
+    return keys
+
+
+class HashRing(object):
+    """Consistent hashing of keys onto nodes, every node at `points` positions of the ring"""
+
+    def __init__(self, nodes, points=100):
+        ring = sorted((self._hash(f'{node}#{i}'), node) for node in nodes for i in range(points))
+        self._hashes = [point for point, node in ring]
+        self._nodes = [node for point, node in ring]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def node(self, key):
+        return self._nodes[bisect(self._hashes, self._hash(key)) % len(self._nodes)]
+
+
+class TaskShards(object):
+    """Routes the session to the shard of an owner: the one named by `owner_shard`, else that of the request's user"""
+
+    def __init__(self, bind_keys, points=100):
+        self.bind_keys = bind_keys
+        self.ring = HashRing(bind_keys, points)
+
+    def init_app(self, app, current_owner):
+        """`current_owner()` is the authenticated user of the request, None before authentication"""
+        self.current_owner = current_owner
+        app.extensions['task_shards'] = self
+        return self
+
+    def bind_key(self, owner):
+        return self.ring.node(owner)
+
+    def session_bind_key(self, session):
+        """Bind key of the shard of `session`, None where no owner is known"""
+        owner = session.info.get('shard_owner')
+        if owner is None and has_request_context():
+            owner = self.current_owner()
+        return None if owner is None else self.bind_key(owner)
+
+
+@contextmanager
+def owner_shard(owner):
+    """Route db.session to the shard of `owner` outside of its requests, such as in the group-commit writer"""
+    previous = db.session.info.get('shard_owner')
+    db.session.info['shard_owner'] = owner
+    try:
+        yield
+    finally:
+        db.session.info['shard_owner'] = previous
+
+
+def task_engines(app):
+    """Engines holding tasks: one per shard, or the default one"""
+    shards = app.extensions.get('task_shards')
+    return [db.engines[key] for key in shards.bind_keys] if shards is not None else [db.engine]
+
+
+def misplaced_owners(shards):
+    """(owner, bind key of its shard now, bind key of its shard by the ring) of owners to move"""
+    found = []
+    for key in shards.bind_keys:
+        with db.engines[key].connect() as connection:
+            owners = connection.scalars(union(*[select(table.c.owner).distinct() for table in OWNER_TABLES])).all()
+        found.extend((owner, key, shards.bind_key(owner)) for owner in owners if shards.bind_key(owner) != key)
+    return found
+
+
+def move_owner(owner, source, target):
+    """Copy the rows of `owner` from the `source` engine to `target`, then delete them from `source`
+
+    The change counters of the owner on the target are raised to those of the source and the rows get new change
+    numbers after them, so a client polling the feed gets the moved tasks again. Rows the target already has,
+    written there since the ring changed or copied by a failed move, are kept. The copy and the delete are separate
+    transactions of two databases, a failed move is repeated.
+    """
+    with source.connect() as connection:
+        rows = {table: [row._asdict() for row in connection.execute(select(table).where(table.c.owner == owner))]
+                for table in OWNER_TABLES}
+        counters = dict(connection.execute(select(Sequences.name, Sequences.next_value).where(
+            Sequences.name.in_([change_seq_name(owner), pruned_seq_name(owner)]))).all())
+    with target.begin() as connection:
+        advance_change_seqs(connection, owner, counters.get(change_seq_name(owner)),
+                            counters.get(pruned_seq_name(owner)))
+        for table in OWNER_TABLES:
+            existing = set(connection.scalars(select(table.c.id).where(table.c.owner == owner)))
+            rows[table] = [row for row in rows[table] if row['id'] not in existing]
+            if rows[table]:
+                for row, change_seq in zip(rows[table], take_change_seqs(connection, owner, len(rows[table]))):
+                    row['change_seq'] = change_seq
+                connection.execute(insert(table), rows[table])
+    with source.begin() as connection:
+        for table in OWNER_TABLES:
+            connection.execute(delete(table).where(table.c.owner == owner))
+    return sum(len(table_rows) for table_rows in rows.values())
+
+
+def rebalance(app, on_moved=None):
+    """Move every owner to the shard the ring assigns it, return the moves as (owner, source, target, rows)
+
+    `on_moved(source, target)` is called with the bind keys of every move.
+    """
+    moves = []
+    shards = app.extensions['task_shards']
+    for owner, source, target in misplaced_owners(shards):
+        moved = move_owner(owner, db.engines[source], db.engines[target])
+        moves.append((owner, source, target, moved))
+        if on_moved is not None:
+            on_moved(source, target)
+    return moves
+
+
+if __name__ == '__main__':
+    from app import create_app, shards_rebalanced
+    from configmodule import DevelopmentConfig
+
+    app = create_app(DevelopmentConfig)
+    with app.app_context():
+        if app.extensions.get('task_shards') is None:
+            raise SystemExit('SQLALCHEMY_SHARD_URIS is not set')
+        for owner, source, target, moved in rebalance(app, shards_rebalanced):
+            print(f'Moved {moved} rows of {owner} from {source} to {target}')
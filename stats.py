@@ -0,0 +1,182 @@
+"""Task statistics kept in counters that the writes update in their own transactions
+
+Every owner has counters of its own, rows of the sequences table named stats.<owner>.<counter>.<slot>. A write
+adds its changes to one randomly chosen of `slots` rows per counter, so concurrent writers rarely wait on the same
+row lock, and a read sums the slots of one owner with primary key lookups instead of scanning the tasks table.
+Writes made outside the API (or counters of an existing database) are repaired by `reconcile`, which recounts the
+table by owner.
+
+Recount once, with the settings of DevelopmentConfig:
+    python3 stats.py
+"""
+import random
+from datetime import datetime, time as day_start
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from models import Tasks, ArchivedTasks, Sequences
+from jobs import start_periodic_job
+
+PREFIX = 'stats.'
+# number of corrections applied by reconcile, a reconcile skips its correction when another one was applied meanwhile
+RECONCILED = 'tasks_stats_reconciled'
+UPSERT_DIALECTS = {'mysql': mysql, 'mariadb': mysql, 'postgresql': postgresql, 'sqlite': sqlite}
+
+
+def utc_today():
+    return datetime.utcnow().date()
+
+
+class TaskStats(object):
+    def __init__(self, slots=8):
+        self.slots = slots
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(slots=config['TASKS_STATS_SLOTS'])
+
+    @staticmethod
+    def counter(owner, name, slot):
+        return f'{PREFIX}{owner}.{name}.{slot}'
+
+    @staticmethod
+    def _parse(counter):
+        """(owner, name) of the counter row named `counter`, owner names may contain dots"""
+        rest = counter[len(PREFIX):].rsplit('.', 1)[0]
+        for name in ('total', 'completed'):
+            if rest.endswith(f'.{name}'):
+                return rest[:-len(name) - 1], name
+        owner, date = rest.rsplit('.created.', 1)
+        return owner, f'created.{date}'
+
+    def _changes(self, owner, total=0, completed=0, created=None):
+        slot = random.randrange(self.slots)
+        changes = {self.counter(owner, 'total', slot): total, self.counter(owner, 'completed', slot): completed}
+        for date, count in (created or {}).items():
+            changes[self.counter(owner, f'created.{date.isoformat()}', slot)] = count
+        return changes
+
+    def increment(self, dialect_name, owner, total=0, completed=0, created=None):
+        """Return the statement adding the changes of `owner` to its counters, or None when nothing changed
+
+        `created` maps creation dates of the created (positive) or deleted (negative) tasks to counts.
+        Execute it last in the transaction of the write, so the counter rows are locked for the shortest time.
+        """
+        return self._add(dialect_name, self._changes(owner, total, completed, created))
+
+    @staticmethod
+    def _add(dialect_name, changes):
+        # sorted, so that writers lock the rows in the same order
+        rows = [{'name': name, 'next_value': value} for name, value in sorted(changes.items()) if value]
+        if not rows:
+            return None
+
+        dialect = UPSERT_DIALECTS[dialect_name]
+        statement = dialect.insert(Sequences).values(rows)
+        if dialect is mysql:
+            return statement.on_duplicate_key_update(next_value=Sequences.next_value + statement.inserted.next_value)
+        return statement.on_conflict_do_update(
+            index_elements=[Sequences.name], set_={'next_value': Sequences.next_value + statement.excluded.next_value})
+
+    @staticmethod
+    def _stats():
+        return dict.fromkeys(('total', 'completed', 'created_today'), 0)
+
+    @staticmethod
+    def _key(name, today):
+        if name.startswith('created.'):
+            return 'created_today' if name == f'created.{today.isoformat()}' else None
+        return name
+
+    def read(self, connection, owner, today=None):
+        """Current statistics of `owner`, read with one primary key lookup per counter row"""
+        today = today or utc_today()
+        names = {'total': 'total', 'completed': 'completed', 'created_today': f'created.{today.isoformat()}'}
+        counters = {self.counter(owner, name, slot): key for key, name in names.items() for slot in range(self.slots)}
+        stats = self._stats()
+        for name, value in connection.execute(select(Sequences.name, Sequences.next_value)
+                                              .where(Sequences.name.in_(counters))):
+            stats[counters[name]] += value
+        stats['open'] = stats['total'] - stats['completed']
+        return stats
+
+    def count(self, connection, today=None):
+        """Statistics of every owner counted in the tasks and archived_tasks tables, by owner"""
+        today = today or utc_today()
+        # archived tasks are counted as tasks, archiving leaves the counters alone
+        stats = {}
+        for table in (Tasks.__table__, ArchivedTasks.__table__):
+            for owner, completed, count in connection.execute(select(table.c.owner, table.c.completed, func.count())
+                                                              .group_by(table.c.owner, table.c.completed)).all():
+                stats.setdefault(owner, self._stats())['total'] += count
+                stats[owner]['completed'] += count if completed else 0
+            created_today = table.c.created_at >= datetime.combine(today, day_start())
+            for owner, count in connection.execute(select(table.c.owner, func.count()).where(created_today)
+                                                   .group_by(table.c.owner)).all():
+                stats.setdefault(owner, self._stats())['created_today'] += count
+        for owner_stats in stats.values():
+            owner_stats['open'] = owner_stats['total'] - owner_stats['completed']
+        return stats
+
+    def reconcile(self, engine):
+        """Recount the tasks and correct the counters of every owner by the difference, return the statistics
+
+        The recount and the counters are read in one snapshot without locks, so writers go on meanwhile. Their
+        difference is then added to the counters in a short transaction: writes committed after the snapshot
+        stay counted. When another reconcile applied its correction after the snapshot, this one applies none.
+        Owners with counters but no tasks left, such as the ones moved to another shard, are corrected to zero.
+        """
+        today = utc_today()
+        with engine.begin() as connection:
+            generation = connection.scalar(select(Sequences.next_value).where(Sequences.name == RECONCILED)) or 0
+            counted = self.count(connection, today)
+            current, past_days = {}, []
+            for name, value in connection.execute(select(Sequences.name, Sequences.next_value)
+                                                  .where(Sequences.name.like(f'{PREFIX}%'))):
+                owner, counter = self._parse(name)
+                key = self._key(counter, today)
+                if key is None:
+                    past_days.append(name)
+                else:
+                    current.setdefault(owner, self._stats())[key] += value
+
+        with engine.begin() as connection:
+            dialect_name = connection.dialect.name
+            # the counter row of the corrections serializes the reconciles
+            connection.execute(self._add(dialect_name, {RECONCILED: 1}))
+            if connection.scalar(select(Sequences.next_value).where(Sequences.name == RECONCILED)) == generation + 1:
+                corrections = {}
+                for owner in counted.keys() | current.keys():
+                    owner_counted, owner_current = counted.get(owner, self._stats()), current.get(owner, self._stats())
+                    corrections.update(self._changes(
+                        owner, total=owner_counted['total'] - owner_current['total'],
+                        completed=owner_counted['completed'] - owner_current['completed'],
+                        created={today: owner_counted['created_today'] - owner_current['created_today']}))
+                correction = self._add(dialect_name, corrections)
+                if correction is not None:
+                    connection.execute(correction)
+                # the counters of past days are read no more
+                if past_days:
+                    connection.execute(delete(Sequences).where(Sequences.name.in_(past_days)))
+        with engine.connect() as connection:
+            return {owner: self.read(connection, owner, today) for owner in sorted(counted)}
+
+
+def start_reconciler(app, engine, interval):
+    """Reconcile the statistics now and then every `interval` seconds, in a daemon thread of this process"""
+    stats = app.extensions['task_stats']
+
+    def reconcile():
+        stats.reconcile(engine)
+
+    return start_periodic_job('task-stats-reconciler', interval, reconcile)
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from sharding import task_engines
+    from configmodule import DevelopmentConfig
+
+    app = create_app(DevelopmentConfig)
+    with app.app_context():
+        for engine in task_engines(app):
+            print(f"{engine.url}: {app.extensions['task_stats'].reconcile(engine)}")
@@ -1,10 +1,41 @@
 import unittest
+import asyncio
+import base64
+import io
 import json
-from datetime import datetime
+import os
+import logging
+import queue
+import time
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from types import SimpleNamespace
+from flask import Flask
+from flask_restful import marshal
 from pymysql import OperationalError
 from pymysql.connections import Connection
-from models import db, Tasks
-from app import create_app
+from models import db, Tasks, task_fields, serialize_task
+from app import create_app, task_create_schema, task_patch_schema, task_list_schema, task_import_schema, \
+    tasks_archived
+from id_allocator import IdAllocator
+from cache import LRUCache, NullCache
+from credentials import Authenticator
+from admission import RateLimiter, ConcurrencyLimit
+from validation import ValidationError
+from importer import csv_records, ndjson_records, import_records
+from sqlalchemy import update, text
+from sqlalchemy.exc import IntegrityError
+from group_commit import GroupCommitWriter
+from archive import archive_tasks
+from werkzeug.security import generate_password_hash
+from asgi_app import TaskASGIApp, async_database_uri
+from metrics import Histogram
+from logs import JSONFormatter, Deduplicate, DroppingQueueHandler
+from jobs import ProcessJobs
+from sharding import HashRing
+from server import server_options
+from benchmark import run_benchmark, compare_results
 import configmodule
 from config import LOGIN, PASSWORD, DB_LOGIN, DB_PASS, DB_HOST, DB_PORT
 
@@ -152,6 +183,452 @@ class TestErrorDB(unittest.TestCase):
         self.assertEqual({'message': 'Database error'}, json.loads(result.data))
 
 
+class TestCache(unittest.TestCase):
+    """Tests the in-process task cache"""
+
+    def test_production_backend(self):
+        """Test that the workers of the production server keep no caches a write in another worker leaves stale"""
+        self.assertIsInstance(configmodule.ProductionConfig.TASKS_CACHE_BACKEND({}), NullCache)
+
+    def test_lru_eviction(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set(1, 'one')
+        cache.set(2, 'two')
+        self.assertEqual('one', cache.get(1))
+        cache.set(3, 'three')
+
+        self.assertIsNone(cache.get(2))
+        self.assertEqual('one', cache.get(1))
+        self.assertEqual('three', cache.get(3))
+        self.assertEqual({'hits': 3, 'misses': 1, 'evictions': 1, 'expirations': 0, 'size': 2, 'max_size': 2},
+                         cache.stats())
+
+    def test_ttl_and_delete(self):
+        cache = LRUCache(max_size=10, ttl=-1)
+        cache.set(1, 'one')
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(1, cache.stats()['expirations'])
+
+        cache = LRUCache(max_size=10, ttl=60)
+        cache.set(1, 'one')
+        cache.delete(1)
+        self.assertIsNone(cache.get(1))
+
+    def test_stale_set(self):
+        cache = LRUCache(max_size=1, ttl=60)
+        generation = cache.generation(1)
+        cache.delete(1)
+        cache.set(1, 'stale', generation)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, 'one', cache.generation(1))
+        self.assertEqual('one', cache.get(1))
+
+        # the delete of 1 is forgotten once 2 is deleted, a fill that started before stays refused
+        generation = cache.generation(3)
+        cache.delete(1)
+        cache.delete(2)
+        cache.set(1, 'stale', generation)
+        cache.set(3, 'three', generation)
+        self.assertIsNone(cache.get(1))
+        self.assertIsNone(cache.get(3))
+        cache.set(3, 'three', cache.generation(3))
+        self.assertEqual('three', cache.get(3))
+
+
+class TestSerializers(unittest.TestCase):
+    """Tests that the compiled serializer matches marshal()"""
+
+    def test_serialize_task(self):
+        tasks = [
+            SimpleNamespace(id=1, title='Task', description='Description', completed=True,
+                            created_at=datetime(2024, 2, 29, 23, 59, 59, 999999), updated_at=None),
+            SimpleNamespace(id=2, title=None, description=None, completed=None,
+                            created_at=datetime(1999, 1, 1, tzinfo=timezone(timedelta(hours=3))),
+                            updated_at=datetime(2024, 12, 1, 8, 5, 3)),
+        ]
+        for task in tasks:
+            row = tuple(getattr(task, key) for key in task_fields)
+            self.assertEqual(json.dumps(marshal(task, task_fields)), json.dumps(serialize_task(row)))
+
+
+class TestValidation(unittest.TestCase):
+    """Tests the request schemas and the limits checked before the database is used"""
+    auth_credentials = (LOGIN, PASSWORD)
+
+    def test_parse(self):
+        self.assertEqual({'title': 'Task', 'description': ''}, task_create_schema.parse({'title': 'Task'}))
+        self.assertEqual({'completed': False}, task_patch_schema.parse({'completed': 'false'}))
+        self.assertEqual({'completed': True}, task_patch_schema.parse({'completed': 1}))
+        self.assertEqual({'description': None}, task_patch_schema.parse({'description': None}))
+        args = task_list_schema.parse({'limit': '5', 'completed': 'False'})
+        self.assertEqual((5, False, 'id', 'asc'), (args['limit'], args['completed'], args['sort'], args['order']))
+        for schema, values in ((task_create_schema, {'description': 'No title'}),
+                               (task_create_schema, {'title': 5}),
+                               (task_patch_schema, {'completed': 'maybe'}),
+                               (task_patch_schema, {'completed': None}),
+                               (task_patch_schema, {'title': None}),
+                               (task_list_schema, {'limit': '0'}),
+                               (task_list_schema, {'sort': 'title'}),
+                               (task_create_schema, ['title'])):
+            with self.assertRaises(ValidationError):
+                schema.parse(values)
+
+    def test_rejected_requests(self):
+        client = create_app(configmodule.TestingConfig).test_client()
+        result = client.post('/todo', json={'description': 'No title'}, auth=self.auth_credentials)
+        self.assertEqual(400, result.status_code)
+        self.assertEqual({'message': {'title': 'No task title provided'}}, result.json)
+        result = client.put('/todo/1', json={'completed': 'maybe'}, auth=self.auth_credentials)
+        self.assertEqual(400, result.status_code)
+        result = client.patch('/todo/1', json={'completed': None}, auth=self.auth_credentials)
+        self.assertEqual({'message': {'completed': 'completed must not be null'}}, result.json)
+        result = client.post('/todo/bulk', data=b' ' * (configmodule.Config.MAX_CONTENT_LENGTH + 1),
+                             content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(413, result.status_code)
+
+
+class TestImporter(unittest.TestCase):
+    """Tests parsing and chunking of streamed imports without a database"""
+
+    def test_records(self):
+        body = b'title,completed\nA,true\n"B\nC",\n'
+        self.assertEqual([(2, {'title': 'A', 'completed': 'true'}, None), (4, {'title': 'B\nC'}, None)],
+                         list(csv_records(io.BytesIO(body))))
+        records = list(ndjson_records(io.BytesIO(b'{"title": "A"}\n\nnot json\n' + b'x' * 20 + b'\n{}'),
+                                      max_line_length=16))
+        self.assertEqual([(1, {'title': 'A'}, None), (3, None, 'Invalid JSON'),
+                          (4, None, 'Line is longer than 16 bytes'), (5, {}, None)], records)
+
+    def test_import_records(self):
+        written = []
+
+        def write(values):
+            if any(value['title'] == 'duplicate' for value in values):
+                raise IntegrityError('INSERT', {}, Exception('Duplicate entry'))
+            written.append([value['title'] for value in values])
+
+        records = [(1, {'title': 'A'}, None), (2, {'title': 'x' * 101}, None), (3, {'title': 'B'}, None),
+                   (4, {'title': 'duplicate'}, None), (5, None, 'Invalid JSON'), (6, {'title': 'C'}, None)]
+        report = import_records(records, task_import_schema, write, chunk_size=2).to_dict()
+        self.assertEqual([['A', 'B'], ['C']], written)
+        self.assertEqual((3, 3), (report['accepted'], report['rejected']))
+        self.assertEqual([2, 4, 5], [error['line'] for error in report['errors']])
+
+
+class TestAdmission(unittest.TestCase):
+    """Tests rate limits, concurrency limits and load shedding"""
+    auth_credentials = (LOGIN, PASSWORD)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=10, burst=2, max_clients=2)
+        self.assertEqual([0, 0], [limiter.acquire('a'), limiter.acquire('a')])
+        self.assertGreater(limiter.acquire('a'), 0)
+        self.assertEqual(0, limiter.acquire('b'))
+        limiter.acquire('c')
+        self.assertEqual(['b', 'c'], list(limiter._buckets))
+
+    def test_concurrency_limit(self):
+        limit = ConcurrencyLimit(1, max_queue=1, timeout=0.01)
+        self.assertTrue(limit.acquire())
+        self.assertFalse(limit.acquire())
+        limit.release()
+        self.assertTrue(limit.acquire())
+
+    def test_rejections(self):
+        class LimitedConfig(configmodule.TestingConfig):
+            ADMISSION_RATE = 1
+            ADMISSION_BURST = 2
+            ADMISSION_MAX_POOL_WAIT = 0.01
+
+        app = create_app(LimitedConfig)
+        client = app.test_client()
+        # the first request counts on the client address, its credentials are not verified yet
+        self.assertEqual([200, 200, 200, 429], [client.get('/todo/cache', auth=self.auth_credentials).status_code
+                                                for _ in range(4)])
+
+        app = create_app(LimitedConfig)
+        client = app.test_client()
+        pool_wait = app.extensions['task_metrics'].pool_waits['default']
+        token = pool_wait.start()
+        pool_wait.finish(pool_wait.start(), 1)
+        result = client.get('/todo/cache', auth=self.auth_credentials)
+        self.assertEqual(503, result.status_code)
+        self.assertEqual('1', result.headers['Retry-After'])
+        self.assertIn('message', result.json)
+        self.assertEqual(200, client.get('/metrics', auth=self.auth_credentials).status_code)
+        pool_wait.finish(token, 0)
+        self.assertEqual(200, client.get('/todo/cache', auth=self.auth_credentials).status_code)
+
+
+class TestLogging(unittest.TestCase):
+    """Tests the JSON records, deduplication and the non-blocking queue of the log"""
+
+    def test_json_records(self):
+        record = logging.makeLogRecord({'name': 'error_handlers', 'levelno': logging.ERROR, 'levelname': 'ERROR',
+                                        'msg': 'Lost connection', 'endpoint': 'task', 'task_id': 1})
+        entry = json.loads(JSONFormatter().format(DroppingQueueHandler(queue.Queue()).prepare(record)))
+        self.assertEqual({'level': 'ERROR', 'logger': 'error_handlers', 'message': 'Lost connection',
+                          'endpoint': 'task', 'task_id': 1}, {key: entry[key] for key in entry if key != 'time'})
+
+    def test_deduplicate(self):
+        deduplicate = Deduplicate(0.05)
+        records = [logging.makeLogRecord({'msg': message}) for message in ('a', 'a', 'b', 'a')]
+        self.assertEqual([True, False, True, False], [deduplicate.filter(record) for record in records])
+        time.sleep(0.05)
+        record = logging.makeLogRecord({'msg': 'a'})
+        self.assertTrue(deduplicate.filter(record))
+        self.assertEqual(2, record.repeated)
+
+    def test_full_queue(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        for message in ('a', 'b', 'c'):
+            handler.handle(logging.makeLogRecord({'msg': message}))
+        self.assertEqual(2, handler.dropped)
+        handler.queue.get_nowait()
+        handler.handle(logging.makeLogRecord({'msg': 'd'}))
+        self.assertEqual((0, 2), (handler.dropped, handler.queue.get_nowait().dropped))
+
+
+class TestServer(unittest.TestCase):
+    """Tests the settings of the production server and the per-process start of the periodic jobs"""
+
+    def test_server_options(self):
+        class ServerConfig(configmodule.TestingConfig):
+            SERVER_WORKERS = None
+            SERVER_MAX_REQUESTS = None
+
+        options = server_options(create_app(ServerConfig))
+        self.assertEqual(os.cpu_count(), options['workers'])
+        self.assertEqual(0, options['max_requests'])
+        self.assertTrue(options['preload_app'])
+        self.assertIn('when_ready', options)
+
+    def test_process_jobs(self):
+        started = []
+        jobs = ProcessJobs()
+        jobs.add(started.append, 'reconciler')
+        jobs.start()
+        jobs.start()
+        self.assertEqual(['reconciler'], started)
+        # as in a forked worker
+        jobs._pid = -1
+        jobs.start()
+        self.assertEqual(['reconciler', 'reconciler'], started)
+
+        jobs = ProcessJobs()
+        jobs.add_once(started.append, 'once')
+        jobs.start()
+        jobs.start_once()
+        self.assertEqual(['reconciler', 'reconciler', 'once'], started)
+        # a worker forked from the process that created the app leaves them to it
+        jobs = ProcessJobs()
+        jobs.add_once(started.append, 'once')
+        jobs._creator_pid = -1
+        jobs.start()
+        self.assertEqual(['reconciler', 'reconciler', 'once'], started)
+
+
+class TestRouting(unittest.TestCase):
+    """Tests routing of reads to replicas and of writes to the primary"""
+
+    class ReplicaConfig(configmodule.TestingConfig):
+        SQLALCHEMY_REPLICA_URIS = [configmodule.TestingConfig.SQLALCHEMY_DATABASE_URI]
+
+    def test_get_bind(self):
+        app = create_app(self.ReplicaConfig)
+        with app.test_request_context('/todo', method='GET'):
+            self.assertIs(db.engines['replica_0'], db.session.get_bind(mapper=Tasks))
+        with app.test_request_context('/todo', method='POST'):
+            self.assertIs(db.engine, db.session.get_bind(mapper=Tasks))
+        with app.app_context():
+            self.assertIs(db.engine, db.session.get_bind(mapper=Tasks))
+
+    def test_pool_options(self):
+        app = create_app(self.ReplicaConfig)
+        with app.app_context():
+            for engine in db.engines.values():
+                self.assertEqual(configmodule.Config.SQLALCHEMY_ENGINE_OPTIONS['pool_size'], engine.pool.size())
+
+
+class TestSharding(unittest.TestCase):
+    """Tests the hash ring placing owners on shards"""
+
+    def test_hash_ring(self):
+        owners = [f'user{i}' for i in range(1000)]
+        ring = HashRing(['shard_a', 'shard_b', 'shard_c'])
+        placed = {owner: ring.node(owner) for owner in owners}
+        self.assertEqual(placed, {owner: HashRing(['shard_c', 'shard_a', 'shard_b']).node(owner) for owner in owners})
+        self.assertEqual({'shard_a', 'shard_b', 'shard_c'}, set(placed.values()))
+
+        # a new shard takes about a quarter of the owners, all of them from the others
+        ring = HashRing(['shard_a', 'shard_b', 'shard_c', 'shard_d'])
+        moved = [owner for owner in owners if ring.node(owner) != placed[owner]]
+        self.assertEqual({'shard_d'}, {ring.node(owner) for owner in moved})
+        self.assertLess(150, len(moved))
+        self.assertLess(len(moved), 350)
+
+
+class TestAuth(unittest.TestCase):
+    """Tests hashed passwords, the cache of verified credentials and token auth"""
+    auth_credentials = (LOGIN, PASSWORD)
+
+    def test_hashed_password(self):
+        authenticator = Authenticator({'user': generate_password_hash('secret')})
+        self.assertIsNone(authenticator.verified('user', 'secret'))
+        self.assertEqual('user', authenticator.verify_password('user', 'secret'))
+        self.assertEqual('user', authenticator.verified('user', 'secret'))
+        self.assertIsNone(authenticator.verify_password('user', 'wrong'))
+        self.assertIsNone(authenticator.verify_password('nobody', 'secret'))
+        self.assertEqual(1, authenticator.stats()['size'])
+
+        authenticator.users['user'] = generate_password_hash('changed')
+        self.assertIsNone(authenticator.verify_password('user', 'secret'))
+
+    def test_token(self):
+        client = create_app(configmodule.TestingConfig).test_client()
+        response = client.post('/todo/token', auth=self.auth_credentials)
+        self.assertEqual(200, response.status_code)
+        token = response.json['token']
+
+        self.assertEqual(200, client.get('/todo/cache', headers={'Authorization': f'Bearer {token}'}).status_code)
+        self.assertEqual(403, client.get('/todo/cache', headers={'Authorization': f'Bearer {token}x'}).status_code)
+        self.assertEqual(403, client.post('/todo/token', headers={'Authorization': f'Bearer {token}'}).status_code)
+        self.assertEqual(403, client.get('/todo/cache', auth=(LOGIN, 'wrong')).status_code)
+
+
+class TestGroupCommit(unittest.TestCase):
+    """Tests batching of concurrent writes by the group-commit writer"""
+
+    def test_batches(self):
+        batches = []
+
+        def write(items):
+            if 'bad' in items:
+                raise ValueError('bad item')
+            batches.append(list(items))
+
+        writer = GroupCommitWriter(Flask(__name__), write, max_delay=0.05, max_batch=4)
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            futures = list(executor.map(writer.submit, ['a', 'b', 'bad', 'c', 'd', 'e', 'f', 'g', 'h', 'i']))
+
+        self.assertRaises(ValueError, futures[2].result, 5)
+        self.assertEqual(['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i'],
+                         sorted(future.result(5) for i, future in enumerate(futures) if i != 2))
+        self.assertEqual(9, sum(len(batch) for batch in batches))
+        self.assertLessEqual(max(len(batch) for batch in batches), 4)
+        self.assertLess(len(batches), 9)
+
+    def test_failures(self):
+        written, release = [], Event()
+
+        def write(items):
+            if 'slow' in items:
+                release.wait(5)
+            written.extend(items)
+
+        def partition(item):
+            if item == 'bad':
+                raise KeyError(item)
+            return 0
+
+        writer = GroupCommitWriter(Flask(__name__), write, max_delay=0, max_batch=1, partition=partition)
+        self.assertRaises(KeyError, writer.submit('bad').result, 5)
+        slow, cancelled = writer.submit('slow'), writer.submit('cancelled')
+        self.assertTrue(cancelled.cancel())
+        release.set()
+        self.assertEqual('slow', slow.result(5))
+        # the writer survived the failed batch and skipped the cancelled item
+        self.assertEqual('good', writer.submit('good').result(5))
+        self.assertEqual(['slow', 'good'], written)
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests request instrumentation and the /metrics endpoint"""
+    auth_credentials = (LOGIN, PASSWORD)
+
+    def test_histogram(self):
+        histogram = Histogram('latency', 'Latency', (0.1, 1), ('endpoint',))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(('task',), value)
+        self.assertEqual(['latency_bucket{endpoint="task",le="0.1"} 2.0',
+                          'latency_bucket{endpoint="task",le="1.0"} 3.0',
+                          'latency_bucket{endpoint="task",le="+Inf"} 4.0',
+                          'latency_sum{endpoint="task"} 5.65',
+                          'latency_count{endpoint="task"} 4.0'], list(histogram.samples()))
+
+    def test_metrics_endpoint(self):
+        client = create_app(configmodule.TestingConfig).test_client()
+        for _ in range(2):
+            client.get('/todo/cache', auth=self.auth_credentials)
+        self.assertEqual(403, client.get('/metrics').status_code)
+
+        response = client.get('/metrics', auth=self.auth_credentials)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.get_data(as_text=True)
+        self.assertIn('todo_http_requests_total{endpoint="task_cache",method="GET",status="200"} 2.0', body)
+        self.assertIn('todo_http_request_duration_seconds_count{endpoint="task_cache",method="GET"} 2.0', body)
+        self.assertIn('# TYPE todo_db_pool_checkout_seconds histogram', body)
+
+
+class TestBenchmark(unittest.TestCase):
+    """Tests the benchmark on a small SQLite run"""
+
+    def test_run_benchmark(self):
+        report = run_benchmark(tasks=20, requests=10, concurrency=2)
+        self.assertEqual(['list', 'get', 'post', 'put', 'delete', 'reject'], list(report['results']))
+        for result in report['results'].values():
+            self.assertEqual(10, result['requests'])
+            self.assertEqual(0, result['errors'])
+            self.assertLessEqual(result['p50'], result['p95'])
+            self.assertLessEqual(result['p95'], result['p99'])
+
+    def test_compare_results(self):
+        baseline = {'get': {'throughput': 100, 'p95': 10, 'errors': 0}}
+        self.assertEqual([], compare_results({'get': {'throughput': 90, 'p95': 11, 'errors': 0}}, baseline, 0.2))
+        self.assertEqual(2, len(compare_results({'get': {'throughput': 70, 'p95': 13, 'errors': 0}}, baseline, 0.2)))
+
+
+class TestASGI(unittest.TestCase):
+    """Tests the asyncio variant of the API"""
+
+    def test_async_database_uri(self):
+        mysql_uri = {'SQLALCHEMY_DATABASE_URI': 'mysql://u:p@h/db'}
+        self.assertEqual('mysql+aiomysql', async_database_uri(mysql_uri).drivername)
+        self.assertEqual('sqlite+aiosqlite', async_database_uri({'SQLALCHEMY_DATABASE_URI': 'sqlite://'}).drivername)
+        self.assertEqual('sqlite+aiosqlite://',
+                         async_database_uri(dict(mysql_uri, SQLALCHEMY_ASYNC_DATABASE_URI='sqlite+aiosqlite://')))
+
+    def test_validation_errors(self):
+        """Test that invalid arguments get the 400 body of the Flask app"""
+        asgi_app = TaskASGIApp(configmodule.TestingConfig)
+        client = create_app(configmodule.TestingConfig).test_client()
+        credentials = base64.b64encode(f'{LOGIN}:{PASSWORD}'.encode())
+
+        def asgi_request(method, path, query_string=b'', body=None):
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'' if body is None else json.dumps(body).encode()}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+                     'headers': [(b'authorization', b'Basic ' + credentials)]}
+            asyncio.run(asgi_app(scope, receive, send))
+            return messages[0]['status'], json.loads(messages[1]['body'])
+
+        for method, path, query_string, body in (('POST', '/todo', b'', {'title': 5}),
+                                                 ('POST', '/todo', b'', {'description': 'No title'}),
+                                                 ('GET', '/todo', b'limit=many', None),
+                                                 ('GET', '/todo', b'sort=updated_at&after=2', None),
+                                                 ('PATCH', '/todo/1', b'', {'completed': 'maybe'})):
+            response = client.open(f"{path}?{query_string.decode()}", method=method, json=body,
+                                   auth=(LOGIN, PASSWORD))
+            self.assertEqual((400, response.json), asgi_request(method, path, query_string, body))
+
+
 class TestAPI(unittest.TestCase):
     """Tests app with DB"""
 
@@ -162,6 +639,9 @@ class TestAPI(unittest.TestCase):
         """Stuff to do before every test."""
 
         self.client = self.app.test_client()
+        # tables are recreated below, behind the back of the API
+        self.app.extensions['task_cache'].clear()
+        self.app.extensions['task_search'] = type(self.app.extensions['task_search'])()
 
         with self.app.app_context(), Connection(host=DB_HOST, port=int(DB_PORT),
                                                 user=DB_LOGIN, password=DB_PASS) as con:
@@ -173,7 +653,7 @@ class TestAPI(unittest.TestCase):
             db.create_all()
             db.session.commit()
 
-            task_add = Tasks(title='New task 1.0', description='Create database MySQL')
+            task_add = Tasks(title='New task 1.0', description='Create database MySQL', owner=LOGIN)
             db.session.add(task_add)
             db.session.commit()
 
@@ -248,6 +728,12 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(data['description'], 'Checking write, read, update')
         self.assertEqual(data['completed'], True)
 
+        # "false" is false, not a non-empty string
+        result = self.client.put("/todo/2", data=json.dumps({'title': 'Database setup', 'completed': 'false'}),
+                                 content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json['completed'], False)
+
         try:
             created_at_datetime = datetime.strptime(data['updated_at'], '%a, %d %b %Y %H:%M:%S %z')
         except ValueError:
@@ -255,6 +741,25 @@ class TestAPI(unittest.TestCase):
 
         self.assertIsInstance(created_at_datetime, datetime)
 
+    def test_patch_task(self):
+        """Test partial update of a task item"""
+        result = self.client.patch("/todo/1", data=json.dumps({'completed': True}),
+                                   content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.json['title'], 'New task 1.0')
+        self.assertEqual(result.json['description'], 'Create database MySQL')
+        self.assertEqual(result.json['completed'], True)
+        self.assertIsNotNone(result.json['updated_at'])
+
+        result = self.client.patch("/todo/1", data=json.dumps({}),
+                                   content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 400)
+
+        result = self.client.patch("/todo/5", data=json.dumps({'title': 'Missing'}),
+                                   content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 404)
+        self.assertEqual(result.json, {'message': 'Task with id 5 not found'})
+
     def test_get_tasks(self):
         """Test retrieving tasks items from db"""
         tasks = [
@@ -305,10 +810,417 @@ class TestAPI(unittest.TestCase):
             data = json.loads(result.data)
             self.assertEqual(result.status_code, 200)
 
+            self.assertIsNone(data['next'])
+
             for i, task in enumerate(tasks_get_tests):
-                self.assertEqual(task['id'], data[i]['id'])
-                self.assertEqual(task['title'], data[i]['title'])
-                self.assertEqual(task['completed'], data[i]['completed'])
+                self.assertEqual(task['id'], data['tasks'][i]['id'])
+                self.assertEqual(task['title'], data['tasks'][i]['title'])
+                self.assertEqual(task['completed'], data['tasks'][i]['completed'])
+
+    def test_get_tasks_pagination(self):
+        """Test keyset pagination and filters of the tasks list"""
+        for i in range(4):
+            result = self.client.post("/todo", data=json.dumps({'title': f'Task {i}'}),
+                                      content_type='application/json', auth=self.auth_credentials)
+            self.assertEqual(result.status_code, 200)
+
+        result = self.client.get('/todo?limit=2', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([1, 2], [task['id'] for task in result.json['tasks']])
+        self.assertEqual(2, result.json['next'])
+
+        result = self.client.get(f"/todo?limit=2&after={result.json['next']}", auth=self.auth_credentials)
+        self.assertEqual([3, 4], [task['id'] for task in result.json['tasks']])
+        self.assertEqual(4, result.json['next'])
+
+        result = self.client.get(f"/todo?limit=2&after={result.json['next']}", auth=self.auth_credentials)
+        self.assertEqual([5], [task['id'] for task in result.json['tasks']])
+        self.assertIsNone(result.json['next'])
+
+        self.client.put('/todo/3', data=json.dumps({'title': 'Task 3', 'completed': True}),
+                        content_type='application/json', auth=self.auth_credentials)
+        result = self.client.get('/todo?completed=true', auth=self.auth_credentials)
+        self.assertEqual([3], [task['id'] for task in result.json['tasks']])
+
+        result = self.client.get('/todo?created_before=2000-01-01T00:00:00Z', auth=self.auth_credentials)
+        self.assertEqual([], result.json['tasks'])
+
+        # limit above the hard server-side maximum is capped
+        max_page_size = configmodule.TestingConfig.TASKS_MAX_PAGE_SIZE
+        result = self.client.get(f'/todo?limit={max_page_size + 1}', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(5, len(result.json['tasks']))
+
+        result = self.client.get('/todo?limit=0', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 400)
+
+    def test_get_tasks_sorted(self):
+        """Test sort orders of the tasks list with keyset pagination"""
+        for i in range(3):
+            self.client.post("/todo", data=json.dumps({'title': f'Task {i}'}),
+                             content_type='application/json', auth=self.auth_credentials)
+        # only tasks 3 and 2 have been updated, in that order
+        for task_id in (3, 2):
+            self.client.put(f'/todo/{task_id}', data=json.dumps({'title': 'Updated'}),
+                            content_type='application/json', auth=self.auth_credentials)
+
+        result = self.client.get('/todo?sort=id&order=desc', auth=self.auth_credentials)
+        self.assertEqual([4, 3, 2, 1], [task['id'] for task in result.json['tasks']])
+
+        ids, after = [], None
+        while True:
+            url = '/todo?sort=updated_at&order=desc&limit=1' + (f'&after={after}' if after else '')
+            result = self.client.get(url, auth=self.auth_credentials)
+            self.assertEqual(result.status_code, 200)
+            ids += [task['id'] for task in result.json['tasks']]
+            after = result.json['next']
+            if after is None:
+                break
+        # updated_at of tasks 2 and 3 may be equal at second precision, then the id decides
+        self.assertIn(ids[:2], ([2, 3], [3, 2]))
+        self.assertEqual([4, 1], ids[2:])
+
+        result = self.client.get('/todo?sort=title', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 400)
+
+    def test_cursor_of_changed_task(self):
+        """Test that changing or deleting the last task of a page leaves the next page where it was"""
+        for i in range(4):
+            self.client.post("/todo", data=json.dumps({'title': f'Task {i}'}),
+                             content_type='application/json', auth=self.auth_credentials)
+
+        result = self.client.get('/todo?sort=updated_at&limit=2', auth=self.auth_credentials)
+        self.assertEqual([1, 2], [task['id'] for task in result.json['tasks']])
+        self.client.patch('/todo/2', data=json.dumps({'title': 'Edited'}),
+                          content_type='application/json', auth=self.auth_credentials)
+        result = self.client.get(f"/todo?sort=updated_at&limit=2&after={result.json['next']}",
+                                 auth=self.auth_credentials)
+        self.assertEqual([3, 4], [task['id'] for task in result.json['tasks']])
+
+        self.client.delete('/todo/4', auth=self.auth_credentials)
+        result = self.client.get(f"/todo?sort=updated_at&limit=2&after={result.json['next']}",
+                                 auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([5, 2], [task['id'] for task in result.json['tasks']])
+
+        # a bare id is a cursor of the id order only
+        result = self.client.get('/todo?sort=updated_at&after=2', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 400)
+
+    def test_cursor_outside_filters(self):
+        """Test that the next page follows a cursor task that no longer matches the filters of the list"""
+        for i in range(3):
+            self.client.post("/todo", data=json.dumps({'title': f'Task {i}'}),
+                             content_type='application/json', auth=self.auth_credentials)
+        url = '/todo?completed=false&sort=created_at&include_archived=true'
+        ids = [task['id'] for task in self.client.get(url, auth=self.auth_credentials).json['tasks']]
+
+        result = self.client.get(f'{url}&limit=2', auth=self.auth_credentials)
+        first_page = [task['id'] for task in result.json['tasks']]
+        self.client.patch(f'/todo/{first_page[-1]}', data=json.dumps({'completed': True}),
+                          content_type='application/json', auth=self.auth_credentials)
+        result = self.client.get(f"{url}&limit=2&after={result.json['next']}", auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(ids, first_page + [task['id'] for task in result.json['tasks']])
+
+    def test_search_tasks(self):
+        """Test full-text search over titles and descriptions"""
+        for title, description in (('Buy groceries', 'Milk and bread'), ('Bake bread', 'Bread with seeds'),
+                                   ('Call plumber', 'Kitchen sink')):
+            self.client.post("/todo", data=json.dumps({'title': title, 'description': description}),
+                             content_type='application/json', auth=self.auth_credentials)
+
+        result = self.client.get('/todo/search?q=bread', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([3, 2], [task['id'] for task in result.json['tasks']])
+
+        result = self.client.get('/todo/search?q=bread&limit=1', auth=self.auth_credentials)
+        self.assertEqual([3], [task['id'] for task in result.json['tasks']])
+        self.assertEqual(1, result.json['next'])
+
+        self.client.delete('/todo/3', auth=self.auth_credentials)
+        self.client.patch('/todo/4', data=json.dumps({'description': 'Sink full of bread'}),
+                          content_type='application/json', auth=self.auth_credentials)
+        result = self.client.get('/todo/search?q=bread', auth=self.auth_credentials)
+        self.assertEqual({2, 4}, {task['id'] for task in result.json['tasks']})
+
+        result = self.client.get('/todo/search', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 400)
+
+    def test_export_tasks(self):
+        """Test streaming the tasks list as NDJSON"""
+        result = self.client.post("/todo", data=json.dumps({'title': 'Export task'}),
+                                  content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+
+        result = self.client.get('/todo/export', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(result.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in result.data.decode().splitlines()]
+        self.assertEqual([1, 2], [task['id'] for task in lines])
+        self.assertEqual('Export task', lines[1]['title'])
+
+        result = self.client.get('/todo?after=1', headers={'Accept': 'application/x-ndjson'},
+                                 auth=self.auth_credentials)
+        self.assertEqual(result.mimetype, 'application/x-ndjson')
+        self.assertEqual(1, len(result.data.decode().splitlines()))
+
+    def test_bulk_tasks(self):
+        """Test bulk create, update and delete in one request"""
+        result = self.client.post("/todo/bulk",
+                                  data=json.dumps({
+                                      'create': [{'title': 'Bulk task 1'}, {'description': 'No title'},
+                                                 {'title': 'Bulk task 2', 'description': 'Second'}],
+                                      'update': [{'id': 1, 'title': 'Updated', 'completed': True}, {'id': 99}],
+                                      'delete': [2, 42],
+                                  }),
+                                  content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([{'id': 2, 'status': 201},
+                          {'status': 400, 'message': 'No task title provided'},
+                          {'id': 3, 'status': 201}], result.json['create'])
+        self.assertEqual([200, 404], [item['status'] for item in result.json['update']])
+        self.assertEqual([200, 404], [item['status'] for item in result.json['delete']])
+
+        result = self.client.get('/todo', auth=self.auth_credentials)
+        self.assertEqual([(1, 'Updated', True), (3, 'Bulk task 2', False)],
+                         [(task['id'], task['title'], task['completed']) for task in result.json['tasks']])
+
+        # the same task twice in update, the first one is applied
+        result = self.client.post("/todo/bulk", data=json.dumps({'update': [{'id': 1, 'title': 'Twice 1'},
+                                                                            {'id': 1, 'title': 'Twice 2'}]}),
+                                  content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([200, 400], [item['status'] for item in result.json['update']])
+        self.assertEqual('Twice 1', self.client.get('/todo/1', auth=self.auth_credentials).json['title'])
+
+        result = self.client.post("/todo/bulk", data=json.dumps([1, 2]),
+                                  content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 400)
+
+    def test_import_tasks(self):
+        """Test streaming import of CSV and NDJSON bodies"""
+        body = 'title,description,completed,created_at\nImported,From CSV,true,2024-01-02T03:04:05Z\n,No title,,\n'
+        result = self.client.post('/todo/import', data=body, content_type='text/csv', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual({'accepted': 1, 'rejected': 1, 'errors': [{'line': 3, 'message': 'No task title provided'}],
+                          'errors_truncated': False}, result.json)
+
+        body = '{"title": "First"}\n{"title": "Second", "completed": "false"}\n{"title": 5}\n'
+        result = self.client.post('/todo/import', data=body, content_type='application/x-ndjson',
+                                  auth=self.auth_credentials)
+        self.assertEqual((2, 1), (result.json['accepted'], result.json['rejected']))
+
+        result = self.client.get('/todo', auth=self.auth_credentials)
+        self.assertEqual([(2, 'Imported', True), (3, 'First', False), (4, 'Second', False)],
+                         [(task['id'], task['title'], task['completed']) for task in result.json['tasks'][1:]])
+        self.assertEqual('Tue, 02 Jan 2024 03:04:05 -0000', result.json['tasks'][1]['created_at'])
+
+        result = self.client.post('/todo/import', data='title', content_type='text/plain', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 415)
+
+    def test_task_stats(self):
+        """Test the statistics counters kept by the writes and their reconciliation"""
+        result = self.client.get('/todo/stats', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        # the task of setUp was inserted behind the back of the API
+        self.assertEqual(0, result.json['total'])
+        with self.app.app_context():
+            self.app.extensions['task_stats'].reconcile(db.engine)
+        result = self.client.get('/todo/stats', auth=self.auth_credentials)
+        self.assertEqual({'total': 1, 'completed': 0, 'open': 1, 'created_today': 1}, result.json)
+
+        for title in ('Stats task 1', 'Stats task 2'):
+            self.client.post("/todo", data=json.dumps({'title': title}),
+                             content_type='application/json', auth=self.auth_credentials)
+        self.client.patch('/todo/1', data=json.dumps({'completed': True}),
+                          content_type='application/json', auth=self.auth_credentials)
+        self.client.put('/todo/2', data=json.dumps({'title': 'Done', 'completed': True}),
+                        content_type='application/json', auth=self.auth_credentials)
+        self.client.delete('/todo/1', auth=self.auth_credentials)
+        result = self.client.get('/todo/stats', auth=self.auth_credentials)
+        self.assertEqual({'total': 2, 'completed': 1, 'open': 1, 'created_today': 2}, result.json)
+
+        # every user has counters of its own
+        with self.app.app_context():
+            db.session.add(Tasks(title='Other task', owner='other'))
+            db.session.commit()
+            stats = self.app.extensions['task_stats'].reconcile(db.engine)
+        self.assertEqual({LOGIN: {'total': 2, 'completed': 1, 'open': 1, 'created_today': 2},
+                          'other': {'total': 1, 'completed': 0, 'open': 1, 'created_today': 1}}, stats)
+        self.assertEqual(2, self.client.get('/todo/stats', auth=self.auth_credentials).json['total'])
+
+    def test_write_database_error(self):
+        """Test that database errors of the writes are logged and answered like those of the reads"""
+        class ServingConfig(configmodule.TestingConfig):
+            TESTING = False
+
+        client = create_app(ServingConfig).test_client()
+        with self.app.app_context():
+            db.session.execute(text('DROP TABLE task_tombstones'))
+            db.session.commit()
+        with self.assertLogs('error_handlers', level='ERROR') as logs:
+            result = client.delete('/todo/1', auth=self.auth_credentials)
+        self.assertEqual((500, {'message': 'Database error'}), (result.status_code, result.json))
+        self.assertEqual(['DELETE'], [record.method for record in logs.records])
+
+    def test_null_completed(self):
+        """Test writes to a task stored with completed NULL, as PUT without completed once left it"""
+        with self.app.app_context():
+            db.session.execute(update(Tasks).where(Tasks.id == 1).values(completed=None))
+            db.session.commit()
+            self.app.extensions['task_stats'].reconcile(db.engine)
+
+        result = self.client.patch('/todo/1', data=json.dumps({'completed': True}),
+                                   content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(1, self.client.get('/todo/stats', auth=self.auth_credentials).json['completed'])
+
+        with self.app.app_context():
+            db.session.execute(update(Tasks).where(Tasks.id == 1).values(completed=None))
+            db.session.commit()
+        result = self.client.put('/todo/1', data=json.dumps({'title': 'Replaced'}),
+                                 content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(('Replaced', False), (result.json['title'], result.json['completed']))
+
+    def test_change_feed(self):
+        """Test the change feed: created and updated tasks and tombstones after a cursor"""
+        for title in ('Feed task 1', 'Feed task 2', 'Feed task 3'):
+            self.client.post("/todo", data=json.dumps({'title': title}),
+                             content_type='application/json', auth=self.auth_credentials)
+        result = self.client.get('/todo/changes?since=0&limit=2', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([2, 3], [task['id'] for task in result.json['tasks']])
+        self.assertTrue(result.json['more'])
+        cursor = result.json['cursor']
+
+        self.client.patch('/todo/2', data=json.dumps({'completed': True}),
+                          content_type='application/json', auth=self.auth_credentials)
+        self.client.delete('/todo/3', auth=self.auth_credentials)
+        result = self.client.get(f'/todo/changes?since={cursor}', auth=self.auth_credentials)
+        self.assertEqual([(4, False), (2, True)], [(task['id'], task['completed']) for task in result.json['tasks']])
+        self.assertEqual([3], result.json['deleted'])
+        self.assertFalse(result.json['more'])
+
+        result = self.client.get(f"/todo/changes?since={result.json['cursor']}", auth=self.auth_credentials)
+        self.assertEqual({'tasks': [], 'deleted': []}, {key: result.json[key] for key in ('tasks', 'deleted')})
+
+    def test_archive_tasks(self):
+        """Test that completed tasks move to the archive and stay readable"""
+        for title in ('Archive task 1', 'Archive task 2'):
+            self.client.post("/todo", data=json.dumps({'title': title}),
+                             content_type='application/json', auth=self.auth_credentials)
+        self.client.patch('/todo/2', data=json.dumps({'completed': True}),
+                          content_type='application/json', auth=self.auth_credentials)
+        with self.app.app_context():
+            self.assertEqual(1, archive_tasks(db.engine, -1, on_archived=tasks_archived))
+
+        result = self.client.get('/todo', auth=self.auth_credentials)
+        self.assertEqual([1, 3], [task['id'] for task in result.json['tasks']])
+        result = self.client.get('/todo?include_archived=true&sort=updated_at&order=desc&limit=2',
+                                 auth=self.auth_credentials)
+        self.assertEqual([2, 3], [task['id'] for task in result.json['tasks']])
+        result = self.client.get(f"/todo?include_archived=true&sort=updated_at&order=desc&after={result.json['next']}",
+                                 auth=self.auth_credentials)
+        self.assertEqual([1], [task['id'] for task in result.json['tasks']])
+
+        result = self.client.get('/todo/2', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(('Archive task 1', True), (result.json['title'], result.json['completed']))
+        result = self.client.patch('/todo/2', data=json.dumps({'completed': False}),
+                                   content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 409)
+        self.assertEqual('Task with id 2 is archived', result.json['message'])
+
+    def test_task_owners(self):
+        """Test that users only see and change their own tasks"""
+        class OwnersConfig(configmodule.TestingConfig):
+            AUTH_USERS = dict(configmodule.TestingConfig.AUTH_USERS, other='other password')
+
+        client = create_app(OwnersConfig).test_client()
+        other = ('other', 'other password')
+        result = client.post('/todo', data=json.dumps({'title': 'Other task'}), content_type='application/json',
+                             auth=other)
+        self.assertEqual(result.status_code, 200)
+        task_id = result.json['id']
+
+        self.assertEqual([task_id], [task['id'] for task in client.get('/todo', auth=other).json['tasks']])
+        self.assertEqual([1], [task['id'] for task in client.get('/todo', auth=self.auth_credentials).json['tasks']])
+        self.assertEqual(404, client.get('/todo/1', auth=other).status_code)
+        self.assertEqual(404, client.get(f'/todo/{task_id}', auth=self.auth_credentials).status_code)
+        self.assertEqual(404, client.delete('/todo/1', auth=other).status_code)
+        self.assertEqual(200, client.get('/todo/1', auth=self.auth_credentials).status_code)
+        result = client.get('/todo/search?q=task', auth=other)
+        self.assertEqual([task_id], [task['id'] for task in result.json['tasks']])
+        # every owner numbers its own changes
+        result = client.get('/todo/changes?since=0', auth=other)
+        self.assertEqual(([task_id], 1), ([task['id'] for task in result.json['tasks']], result.json['cursor']))
+
+        # the version of a list follows the changes of its owner only
+        etag = client.get('/todo', auth=self.auth_credentials).headers['ETag']
+        client.patch(f'/todo/{task_id}', json={'title': 'Renamed'}, auth=other)
+        result = client.get('/todo', headers={'If-None-Match': etag}, auth=self.auth_credentials)
+        self.assertEqual(304, result.status_code)
+
+    def test_id_allocator(self):
+        """Test that allocators sharing the sequences table never hand out the same id"""
+        with self.app.app_context():
+            first, second = IdAllocator(Tasks, 5), IdAllocator(Tasks, 5)
+            ids = first.allocate(3) + second.allocate(3) + first.allocate(4) + second.allocate(12)
+
+        self.assertEqual(len(ids), len(set(ids)))
+        # the task created in setUp keeps its id
+        self.assertEqual(2, min(ids))
+
+    def test_conditional_requests(self):
+        """Test ETag, If-None-Match and If-Match handling"""
+        result = self.client.get('/todo/1', auth=self.auth_credentials)
+        etag = result.headers['ETag']
+        result = self.client.get('/todo/1', headers={'If-None-Match': etag}, auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 304)
+
+        result = self.client.get('/todo', auth=self.auth_credentials)
+        list_etag = result.headers['ETag']
+        result = self.client.get('/todo', headers={'If-None-Match': list_etag}, auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 304)
+
+        result = self.client.put('/todo/1', data=json.dumps({'title': 'Updated'}), headers={'If-Match': etag},
+                                 content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        self.assertNotEqual(etag, result.headers['ETag'])
+
+        # the task and the list changed, so the old ETags are stale
+        result = self.client.get('/todo/1', headers={'If-None-Match': etag}, auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+        result = self.client.get('/todo', headers={'If-None-Match': list_etag}, auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 200)
+
+        result = self.client.put('/todo/1', data=json.dumps({'title': 'Lost update'}), headers={'If-Match': etag},
+                                 content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 412)
+        result = self.client.delete('/todo/1', headers={'If-Match': etag}, auth=self.auth_credentials)
+        self.assertEqual(result.status_code, 412)
+        self.assertEqual('Updated', self.client.get('/todo/1', auth=self.auth_credentials).json['title'])
+
+    def test_cache_invalidation(self):
+        """Test that cached tasks are replaced after every kind of write"""
+        self.assertEqual('New task 1.0', self.client.get('/todo/1', auth=self.auth_credentials).json['title'])
+        self.assertEqual('New task 1.0', self.client.get('/todo/1', auth=self.auth_credentials).json['title'])
+
+        self.client.put('/todo/1', data=json.dumps({'title': 'Put'}),
+                        content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual('Put', self.client.get('/todo/1', auth=self.auth_credentials).json['title'])
+
+        self.client.post('/todo/bulk', data=json.dumps({'update': [{'id': 1, 'title': 'Bulk'}]}),
+                         content_type='application/json', auth=self.auth_credentials)
+        self.assertEqual('Bulk', self.client.get('/todo/1', auth=self.auth_credentials).json['title'])
+
+        self.client.delete('/todo/1', auth=self.auth_credentials)
+        self.assertEqual(404, self.client.get('/todo/1', auth=self.auth_credentials).status_code)
+
+        stats = self.client.get('/todo/cache', auth=self.auth_credentials).json
+        self.assertEqual(1, stats['hits'])
 
     def test_delete_tasks(self):
         """Task deletion test items from db and authorized access"""
@@ -342,7 +1254,7 @@ class TestAPI(unittest.TestCase):
         self.client.delete('/todo/1', auth=self.auth_credentials)
         result = self.client.get('/todo', auth=self.auth_credentials)
         self.assertEqual(result.status_code, 200)
-        self.assertEqual(result.json, [])
+        self.assertEqual(result.json, {'tasks': [], 'next': None})
 
     def test_handler_data_error(self):
         """Test of an attempt to write a value in the title that is greater than expected"""
@@ -0,0 +1,150 @@
+"""Validation of request arguments against schemas built once, when the modules are imported
+
+Flask-RESTful instantiates a resource per request, so a reqparse.RequestParser made in its __init__ was rebuilt,
+and then walked argument by argument through the request proxies, on every call. A Schema is a tuple of
+(name, converter, ...) entries made once; parsing a dict is one lookup and one converter call per field.
+"""
+from datetime import datetime, timezone
+from flask_restful import inputs
+
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+class ValidationError(ValueError):
+    """Invalid argument `name` (None when the input as a whole is wrong)"""
+
+    def __init__(self, name, message):
+        super(ValidationError, self).__init__(message)
+        self.name = name
+        self.message = message
+
+
+def string(value):
+    if not isinstance(value, str):
+        raise ValueError('must be a string')
+    return value
+
+
+def boolean(value):
+    """JSON booleans, 0 and 1, or 'true', 'false', '1', '0' in any case; unlike bool('false'), which is True"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in BOOLEANS:
+        return BOOLEANS[value.lower()]
+    raise ValueError('must be a boolean')
+
+
+def integer(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lstrip('+-').isdigit():
+        return int(value)
+    raise ValueError('must be an integer')
+
+
+def natural(value):
+    value = integer(value)
+    if value < 0:
+        raise ValueError('must be a non-negative integer')
+    return value
+
+
+def positive(value):
+    value = integer(value)
+    if value < 1:
+        raise ValueError('must be a positive integer')
+    return value
+
+
+def utc_datetime(value):
+    """Parse an ISO 8601 value into a naive UTC datetime, as stored in the db"""
+    try:
+        value = inputs.datetime_from_iso8601(string(value))
+    except ValueError:
+        raise ValueError('must be an ISO 8601 date and time')
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def cursor(value):
+    """A keyset cursor: a task id, or '<ISO 8601 sort value>,<task id>' (an empty value for NULL) as a pair"""
+    if isinstance(value, str) and ',' in value:
+        sort_value, task_id = value.rsplit(',', 1)
+        try:
+            return datetime.fromisoformat(sort_value) if sort_value else None, natural(task_id)
+        except ValueError:
+            raise ValueError('must be the next of a page')
+    return natural(value)
+
+
+# converters of the column types, by their python_type
+COLUMN_CONVERTERS = {str: string, bool: boolean, int: integer, datetime: utc_datetime}
+
+
+class Field(object):
+    def __init__(self, convert, required=False, default=None, choices=None, help=None, max_length=None,
+                 nullable=True):
+        self.convert = convert
+        self.required = required
+        self.default = default
+        self.choices = choices
+        self.help = help
+        self.max_length = max_length
+        # False rejects an explicit null instead of giving it the default
+        self.nullable = nullable
+
+    @classmethod
+    def for_column(cls, column, **options):
+        return cls(COLUMN_CONVERTERS[column.type.python_type], **options)
+
+    def replace(self, **options):
+        return Field(**dict(vars(self), **options))
+
+
+class Schema(object):
+    """Named fields of a JSON body or of query arguments
+
+    `parse` returns a dict with every field: missing and null ones get their default, null ones are rejected for
+    fields that are not `nullable`. A `partial` schema returns the fields present in the input only, as a PATCH
+    needs. Unknown names are ignored.
+    """
+
+    def __init__(self, fields, partial=False):
+        self.fields = dict(fields)
+        self.partial = partial
+        self._entries = tuple((name, field.convert, field.required, field.default,
+                               frozenset(field.choices) if field.choices else None,
+                               field.help or f'Missing required parameter {name}', field.max_length, field.nullable)
+                              for name, field in self.fields.items())
+
+    def extend(self, fields):
+        return Schema(dict(self.fields, **fields), partial=self.partial)
+
+    def parse(self, values):
+        """Validate and convert a dict, such as a JSON body, one item of a bulk request or request.args"""
+        if not isinstance(values, dict):
+            raise ValidationError(None, 'Expected a JSON object')
+        args = {}
+        for name, convert, required, default, choices, missing, max_length, nullable in self._entries:
+            value = values.get(name)
+            if value is None:
+                if required:
+                    raise ValidationError(name, missing)
+                if not nullable and name in values:
+                    raise ValidationError(name, f'{name} must not be null')
+                if not self.partial or name in values:
+                    args[name] = default
+                continue
+            try:
+                value = convert(value)
+            except (TypeError, ValueError) as e:
+                raise ValidationError(name, f'Invalid value for {name}: {value} ({e})')
+            if choices is not None and value not in choices:
+                raise ValidationError(name, f'{value} is not a valid choice for {name}')
+            if max_length is not None and len(value) > max_length:
+                raise ValidationError(name, f'{name} is longer than {max_length} characters')
+            args[name] = value
+        return args
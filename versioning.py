@@ -0,0 +1,46 @@
+from sqlalchemy import select
+from models import db, Sequences
+from id_allocator import advance_sequence
+from changes import change_seq_name
+
+# row of the sequences table counting the changes to the task lists that take no change number: archiving tasks
+# and moving owners between shards
+TASKS_VERSION = 'tasks_version'
+
+
+def task_etag(task_id, version):
+    """ETag of a single task, changes with every update of the row"""
+    return f'{task_id}.{version}'
+
+
+def _versions_statement(owner):
+    return select(Sequences.name, Sequences.next_value).where(Sequences.name.in_([change_seq_name(owner),
+                                                                                   TASKS_VERSION]))
+
+
+def _list_version(rows, owner):
+    versions = dict(rows)
+    return f'{versions.get(change_seq_name(owner), 0)}.{versions.get(TASKS_VERSION, 0)}'
+
+
+def tasks_version(owner):
+    """Current version of the task list of `owner`, one lookup of two primary keys
+
+    Every write of the owner takes a number from its change counter inside its own transaction, so the counter
+    is the version of its list without a commit of its own. Readers take the version before loading rows, in the
+    same transaction, so an ETag always belongs to the data it was sent with.
+    """
+    return _list_version(db.session.execute(_versions_statement(owner)).all(), owner)
+
+
+def bump_tasks_version(engine=None):
+    """Advance the version of all lists of a database after archiving tasks or moving owners
+
+    Bumped in its own transaction after the change commits. The version is kept in the database of the change,
+    `engine` or that of the session (the shard of the owner).
+    """
+    return advance_sequence(TASKS_VERSION, 1, engine=engine or db.session.get_bind())
+
+
+async def tasks_version_async(connection, owner):
+    return _list_version((await connection.execute(_versions_statement(owner))).all(), owner)